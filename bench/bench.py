@@ -0,0 +1,186 @@
+# babyxml benchmarks over the payloads in bench/corpus
+# runs off-device with CPython so parser regressions show up before they're on the device:
+#   python3 bench/bench.py                        # everything
+#   python3 bench/bench.py -k browse              # only payloads with 'browse' in the name
+#   python3 bench/bench.py --json out.json        # save the results
+#   python3 bench/bench.py --baseline out.json    # compare with saved results; exits 1 on a regression
+#
+# for each payload and operation it reports
+#   time    - best mean time per call over --repeat rounds
+#   blocks  - memory blocks still allocated after the call (the size of what it built)
+#   kept    - bytes still allocated after the call
+#   peak    - the most memory in use at once during the call
+# measured with tracemalloc; inputs are prepared beforehand so they aren't counted
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import babyxml  # noqa: E402
+
+
+CORPUS = os.path.join(HERE, 'corpus')
+# escaped documents nested inside the payloads, parsed as a second step on the device
+INNER = {
+    'e:propertyset/e:property/LastChange': 'event',
+    's:Envelope/s:Body/u:BrowseResponse/Result': 'didl',
+    's:Envelope/s:Body/u:GetPositionInfoResponse/TrackMetaData': 'didl',
+}
+# time spent per round on each measurement
+ROUND_S = 0.05
+# growth over the baseline that counts as a regression; timings are noisy, memory isn't
+REGRESSION = {
+    'time_us': 1.5,
+    'peak': 1.1,
+    'kept': 1.1,
+}
+
+
+def plain(doc):
+    # xmltodict output as the {name: value} dicts dicttoxml takes
+    # (attributes are dropped and repeated elements become lists)
+    out = {}
+    for (name, idx), value in doc.items():
+        if name.endswith('_attrs'):
+            continue
+        value = plain(value) if isinstance(value, dict) else value
+        if idx == 0:
+            out[name] = value
+        elif isinstance(out[name], list):
+            out[name].append(value)
+        else:
+            out[name] = [out[name], value]
+    return out
+
+
+def payloads():
+    # (name, raw bytes, escaped inner document or None)
+    for filename in sorted(os.listdir(CORPUS)):
+        if not filename.endswith('.xml'):
+            continue
+        with open(os.path.join(CORPUS, filename), 'rb') as f:
+            raw = f.read()
+        inner = None
+        values = babyxml.select(raw, INNER)
+        for path, kind in INNER.items():
+            if values.get(path):
+                inner = (kind, values[path])
+        yield filename[:-4], raw, inner
+
+
+def operations(raw, inner):
+    # (operation name, function, argument)
+    text = raw.decode('utf-8')
+    yield 'xmltodict', babyxml.xmltodict, text
+    yield 'xmltodict(bytes)', babyxml.xmltodict, raw
+    yield 'parse(bytes)', babyxml.parse, raw
+    yield 'dicttoxml', babyxml.dicttoxml, plain(babyxml.xmltodict(text))
+    if inner is not None:
+        kind, value = inner
+        # what htmldecode did to the whole nested document before babyxml decoded entities itself
+        escaped = babyxml.escape(value)
+        yield 'htmldecode', babyxml.unescape, escaped
+        yield f'xmltodict({kind})', babyxml.xmltodict, value
+        yield f'parse({kind})', babyxml.parse, value
+
+
+def measure_time(func, arg, repeat):
+    # calibrate the number of calls per round, then keep the best round
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func(arg)
+        elapsed = time.perf_counter() - start
+        if elapsed >= ROUND_S:
+            break
+        calls *= 2
+    best = elapsed / calls
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func(arg)
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+
+def measure_memory(func, arg):
+    gc.collect()
+    tracemalloc.start()
+    result = func(arg)
+    gc.collect()
+    kept, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics('filename'))
+    del result
+    return blocks, kept, peak
+
+
+def run(name_filter=None, repeat=5):
+    results = {}
+    for name, raw, inner in payloads():
+        if name_filter and name_filter not in name:
+            continue
+        for op, func, arg in operations(raw, inner):
+            # warm up (first calls build caches etc)
+            func(arg)
+            blocks, kept, peak = measure_memory(func, arg)
+            results[f'{name} {op}'] = {
+                'size': len(raw),
+                'time_us': measure_time(func, arg, repeat) * 1e6,
+                'blocks': blocks,
+                'kept': kept,
+                'peak': peak,
+            }
+    return results
+
+
+def report(results, baseline=None):
+    regressions = []
+    print(f'{"payload / operation":48} {"bytes":>8} {"time us":>10} {"blocks":>8} {"kept":>10} {"peak":>10}')
+    for key, r in results.items():
+        line = f'{key:48} {r["size"]:8} {r["time_us"]:10.1f} {r["blocks"]:8} {r["kept"]:10} {r["peak"]:10}'
+        if baseline and key in baseline:
+            base = baseline[key]
+            ratio = r['time_us'] / base['time_us']
+            line += f'  x{ratio:.2f}'
+            for metric, limit in REGRESSION.items():
+                if base[metric] and r[metric] > limit * base[metric]:
+                    regressions.append(f'{key}: {metric} {base[metric]:.1f} -> {r[metric]:.1f}')
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='babyxml benchmarks')
+    parser.add_argument('-k', dest='name_filter', help='only payloads whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5, help='timing rounds per measurement')
+    parser.add_argument('--json', help='save the results here')
+    parser.add_argument('--baseline', help='compare with results saved by --json')
+    args = parser.parse_args()
+
+    results = run(args.name_filter, args.repeat)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        print(f'\n{len(regressions)} regression(s):')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# babyxml equivalence checks, run off-device with CPython next to the benchmarks:
+#   python3 bench/check.py
+#
+# for the payloads in bench/corpus, their nested documents, the edge cases below and a batch of
+# random documents:
+#   parse(doc).to_dict() has to be the same document xmltodict(doc) builds
+#   dicttoxml() of either has to read back as that same document
+# exits 1 on the first mismatch
+import argparse
+import os
+import random
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import babyxml  # noqa: E402
+from bench import payloads  # noqa: E402
+
+
+# documents that have tripped things up before
+EDGE_CASES = [
+    # attribute-only element followed by a sibling of the same name; they share an index
+    '<r><c x="1"></c><c>t</c></r>',
+    '<r><c x="1"></c><c y="2">t</c></r>',
+    '<r><c>t</c><c x="1"></c></r>',
+    '<r><c x="1"></c><c x="2"></c><c>t</c><c x="3"></c></r>',
+    '<r><c x="1"><d></d></c><c>t</c></r>',
+    # elements without content or attributes are left out
+    '<r><c></c><c>t</c></r>',
+    '<r><c><d></d></c></r>',
+    # self-closing elements, with and without attributes
+    '<r><e/></r>',
+    '<r><e x="1"/><e x="2" /><e /></r>',
+]
+# documents dicttoxml has to write back exactly as they are
+CANONICAL = [
+    '<r><e/></r>',
+    '<r><e x="1"/><e>t</e><f><g/></f></r>',
+    '<r><c x="a &amp; b">&lt;t&gt;</c></r>',
+]
+RANDOM_DOCUMENTS = 5000
+
+
+def random_elements(depth=0):
+    out = []
+    for _ in range(random.randint(0, 4)):
+        name = random.choice('abc')
+        attrs = f' x="{random.randint(0, 9)}"' if random.random() < 0.3 else ''
+        r = random.random()
+        if r < 0.2:
+            out.append(f'<{name}{attrs}/>')
+        elif r < 0.35:
+            out.append(f'<{name}{attrs}></{name}>')
+        elif r < 0.6 or depth > 3:
+            out.append(f'<{name}{attrs}>t{random.randint(0, 9)}</{name}>')
+        else:
+            out.append(f'<{name}{attrs}>{random_elements(depth + 1) or "t"}</{name}>')
+    return ''.join(out)
+
+
+def documents(count, seed):
+    # (name, document)
+    for name, raw, inner in payloads():
+        yield name, raw
+        if inner is not None:
+            yield f'{name} {inner[0]}', inner[1]
+    for n, doc in enumerate(EDGE_CASES):
+        yield f'edge case {n}', doc
+    random.seed(seed)
+    for n in range(count):
+        yield f'random {n}', f'<r>{random_elements()}</r>'
+
+
+def lookups_match(node, expected):
+    # node[key] for every key of the xmltodict document, all the way down
+    for key, value in expected.items():
+        found = node.get(key)
+        if isinstance(value, dict) and isinstance(found, babyxml.Node):
+            if not lookups_match(found, value):
+                return False
+        elif found != value:
+            return False
+    return len(node) == len(expected)
+
+
+def check(name, doc):
+    # returns a description of what's wrong, or None
+    expected = babyxml.xmltodict(doc)
+    node = babyxml.parse(doc)
+    if node.to_dict() != expected:
+        return f'{name}: parse() differs from xmltodict()'
+    if not lookups_match(node, expected):
+        return f'{name}: parse() lookups differ from xmltodict()'
+    if babyxml.xmltodict(babyxml.dicttoxml(expected)) != expected:
+        return f'{name}: dicttoxml(xmltodict()) does not read back the same'
+    if babyxml.xmltodict(babyxml.dicttoxml(node)) != expected:
+        return f'{name}: dicttoxml(parse()) does not read back the same'
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='babyxml equivalence checks')
+    parser.add_argument('--random', type=int, default=RANDOM_DOCUMENTS, help='number of random documents')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for doc in CANONICAL:
+        written = babyxml.dicttoxml(babyxml.xmltodict(doc))
+        if written != doc:
+            print(f'dicttoxml() wrote {written} for {doc}')
+            sys.exit(1)
+
+    checked = len(CANONICAL)
+    for name, doc in documents(args.random, args.seed):
+        problem = check(name, doc)
+        if problem:
+            print(problem)
+            print(doc if isinstance(doc, str) else doc.decode('utf-8'))
+            sys.exit(1)
+        checked += 1
+    print(f'{checked} documents ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# generates the benchmark corpus in bench/corpus: payloads shaped like the ones a Sonos player sends
+# (device description, GENA propertysets with LastChange, SOAP responses, queue Browse results)
+# run with CPython: python3 bench/make_corpus.py [output dir]
+import os
+import sys
+from xml.sax.saxutils import escape
+
+OUT = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+TRACKS = [
+    ('Hyperballad', 'Björk', 'Post', 'x-sonos-spotify:spotify%3atrack%3a2jjFb4m1PQP0NjL6vM8pxg?sid=12&flags=8224&sn=1', '0:05:21'),
+    ('Teardrop', 'Massive Attack', 'Mezzanine', 'x-sonos-spotify:spotify%3atrack%3a67Hna13dNDkZvBpTXRIaOJ?sid=12&flags=8224&sn=1', '0:05:29'),
+    ('Windowlicker', 'Aphex Twin', 'Windowlicker', 'x-file-cifs://nas/music/Aphex%20Twin/Windowlicker/01%20Windowlicker.flac', '0:06:07'),
+    ("Don't Stop Me Now", 'Queen', 'Jazz (2011 Remaster)', 'x-sonos-http:librarytrack%3ai.ZqmlE9mT0vkKM.mp4?sid=204&flags=8224&sn=3', '0:03:29'),
+    ('Rhythm & Blues <Live>', 'Sade & Friends', 'Live "At Home"', 'x-sonosapi-hls-static:ALkSOiH8dP?sid=284&flags=8&sn=7', '0:04:12'),
+]
+
+
+def didl_item(i, title, artist, album, uri, duration, item_id=None):
+    art = f'/getaa?s=1&u={escape(uri)}' if i % 2 else f'https://i.scdn.co/image/ab67616d0000b273{i:040x}?w=200&auto=format,compress?w=200'
+    return (
+        f'<item id="{item_id or "-1"}" parentID="{"Q:0" if item_id else "-1"}" restricted="true">'
+        f'<res protocolInfo="sonos.com-spotify:*:audio/x-spotify:*" duration="{duration}">{escape(uri)}</res>'
+        f'<upnp:albumArtURI>{escape(art)}</upnp:albumArtURI>'
+        f'<upnp:class>object.item.audioItem.musicTrack</upnp:class>'
+        f'<dc:title>{escape(title)}</dc:title>'
+        f'<dc:creator>{escape(artist)}</dc:creator>'
+        f'<upnp:album>{escape(album)}</upnp:album>'
+        f'</item>'
+    )
+
+
+def didl(items):
+    return (
+        '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/"'
+        ' xmlns:r="urn:schemas-rinconnetworks-com:metadata-1-0/" xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'
+        + ''.join(items) + '</DIDL-Lite>'
+    )
+
+
+def soap(action, service, fields):
+    body = ''.join(f'<{k}>{v}</{k}>' for k, v in fields)
+    return (
+        '<?xml version="1.0" encoding="utf-8"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"'
+        ' s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+        f'<u:{action}Response xmlns:u="urn:schemas-upnp-org:service:{service}:1">{body}</u:{action}Response>'
+        '</s:Body></s:Envelope>'
+    )
+
+
+def last_change_avtransport():
+    t = TRACKS[0]
+    track_meta = didl([didl_item(0, *t)])
+    uri_meta = didl(['<item id="R:0/0/0" parentID="R:0/0" restricted="true"><dc:title>Chill Vibes</dc:title>'
+                     '<upnp:class>object.item.audioItem.audioBroadcast</upnp:class>'
+                     '<desc id="cdudn" nameSpace="urn:schemas-rinconnetworks-com:metadata-1-0/">SA_RINCON2311_X_#Svc2311-0-Token</desc></item>'])
+    next_meta = didl([didl_item(1, *TRACKS[1])])
+    fields = [
+        ('TransportState', 'PLAYING'),
+        ('CurrentPlayMode', 'NORMAL'),
+        ('CurrentCrossfadeMode', '0'),
+        ('NumberOfTracks', '42'),
+        ('CurrentTrack', '7'),
+        ('CurrentSection', '0'),
+        ('CurrentTrackURI', t[3]),
+        ('CurrentTrackDuration', t[4]),
+        ('CurrentTrackMetaData', track_meta),
+        ('r:NextTrackURI', TRACKS[1][3]),
+        ('r:NextTrackMetaData', next_meta),
+        ('r:EnqueuedTransportURI', 'x-rincon-cpcontainer:1006206cspotify%3aplaylist%3a37i9dQZF1DX4WYpdgoIcn6?sid=12&flags=8300&sn=1'),
+        ('r:EnqueuedTransportURIMetaData', uri_meta),
+        ('PlaybackStorageMedium', 'NETWORK'),
+        ('AVTransportURI', 'x-rincon-queue:RINCON_48A6B8D1E2F301400#0'),
+        ('AVTransportURIMetaData', uri_meta),
+        ('NextAVTransportURI', ''),
+        ('NextAVTransportURIMetaData', ''),
+        ('CurrentTransportActions', 'Set, Stop, Pause, Play, X_DLNA_SeekTime, Next, Previous, X_DLNA_SeekTrackNr'),
+        ('r:CurrentValidPlayModes', 'SHUFFLE,REPEAT,REPEATONE,CROSSFADE'),
+        ('r:DirectControlClientID', ''),
+        ('r:DirectControlIsSuspended', '0'),
+        ('r:DirectControlAccountID', ''),
+        ('TransportStatus', 'OK'),
+        ('r:SleepTimerGeneration', '0'),
+        ('r:AlarmRunning', '0'),
+        ('r:SnoozeRunning', '0'),
+        ('r:RestartPending', '0'),
+        ('TransportPlaySpeed', '1'),
+        ('CurrentMediaDuration', ''),
+        ('RecordStorageMedium', 'NOT_IMPLEMENTED'),
+        ('PossiblePlaybackStorageMedia', 'NONE, NETWORK'),
+        ('PossibleRecordStorageMedia', 'NOT_IMPLEMENTED'),
+        ('RecordMediumWriteStatus', 'NOT_IMPLEMENTED'),
+        ('CurrentRecordQualityMode', 'NOT_IMPLEMENTED'),
+        ('PossibleRecordQualityModes', 'NOT_IMPLEMENTED'),
+    ]
+    event = ('<Event xmlns="urn:schemas-upnp-org:metadata-1-0/AVT/" xmlns:r="urn:schemas-rinconnetworks-com:metadata-1-0/">'
+             '<InstanceID val="0">'
+             + ''.join(f'<{k} val="{escape(v, {chr(34): "&quot;"})}"/>' for k, v in fields)
+             + '</InstanceID></Event>')
+    return propertyset('LastChange', event)
+
+
+def last_change_rendering():
+    event = ('<Event xmlns="urn:schemas-upnp-org:metadata-1-0/RCS/"><InstanceID val="0">'
+             '<Volume channel="Master" val="23"/><Volume channel="LF" val="100"/><Volume channel="RF" val="100"/>'
+             '<Mute channel="Master" val="0"/><Mute channel="LF" val="0"/><Mute channel="RF" val="0"/>'
+             '<Bass val="0"/><Treble val="0"/><Loudness channel="Master" val="1"/>'
+             '<OutputFixed val="0"/><HeadphoneConnected val="0"/><SpeakerSize val="3"/>'
+             '<SubGain val="0"/><SubCrossover val="0"/><SubPolarity val="0"/><SubEnabled val="1"/>'
+             '<SonarEnabled val="1"/><SonarCalibrationAvailable val="1"/>'
+             '<PresetNameList val="FactoryDefaults"/></InstanceID></Event>')
+    return propertyset('LastChange', event)
+
+
+def propertyset(name, value):
+    return ('<?xml version="1.0"?><e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0"><e:property>'
+            f'<{name}>{escape(value)}</{name}></e:property></e:propertyset>')
+
+
+def position_info():
+    t = TRACKS[4]
+    return soap('GetPositionInfo', 'AVTransport', [
+        ('Track', '7'),
+        ('TrackDuration', t[4]),
+        ('TrackMetaData', escape(didl([didl_item(4, *t)]))),
+        ('TrackURI', escape(t[3])),
+        ('RelTime', '0:01:37'),
+        ('AbsTime', 'NOT_IMPLEMENTED'),
+        ('RelCount', '2147483647'),
+        ('AbsCount', '2147483647'),
+    ])
+
+
+def browse(n):
+    items = [didl_item(i, *TRACKS[i % len(TRACKS)], item_id=f'Q:0/{i + 1}') for i in range(n)]
+    return soap('Browse', 'Queue', [
+        ('Result', escape(didl(items))),
+        ('NumberReturned', str(n)),
+        ('TotalMatches', str(n)),
+        ('UpdateID', '413'),
+    ])
+
+
+SERVICES = [
+    ('AlarmClock', 'AlarmClock'), ('MusicServices', 'MusicServices'), ('AudioIn', 'AudioIn'),
+    ('DeviceProperties', 'DeviceProperties'), ('SystemProperties', 'SystemProperties'),
+    ('ZoneGroupTopology', 'ZoneGroupTopology'), ('GroupManagement', 'GroupManagement'),
+    ('QPlay', 'Tencent-com:serviceId:QPlay'),
+]
+MS_SERVICES = ['ContentDirectory', 'ConnectionManager']
+MR_SERVICES = ['RenderingControl', 'ConnectionManager', 'AVTransport', 'Queue', 'GroupRenderingControl', 'VirtualLineIn']
+
+
+def service(name, prefix=''):
+    return (f'<service><serviceType>urn:schemas-upnp-org:service:{name}:1</serviceType>'
+            f'<serviceId>urn:upnp-org:serviceId:{name}</serviceId>'
+            f'<controlURL>{prefix}/{name}/Control</controlURL>'
+            f'<eventSubURL>{prefix}/{name}/Event</eventSubURL>'
+            f'<SCPDURL>/xml/{name}1.xml</SCPDURL></service>')
+
+
+def device_description():
+    icon = ('<iconList><icon><id>0</id><mimetype>image/png</mimetype><width>48</width><height>48</height>'
+            '<depth>24</depth><url>/img/icon-S22.png</url></icon></iconList>')
+    ms = ('<device><deviceType>urn:schemas-upnp-org:device:MediaServer:1</deviceType>'
+          '<friendlyName>192.168.1.20 - Sonos One - RINCON_48A6B8D1E2F301400</friendlyName>'
+          '<manufacturer>Sonos, Inc.</manufacturer><manufacturerURL>http://www.sonos.com</manufacturerURL>'
+          '<modelNumber>S22</modelNumber><modelDescription>Sonos One Media Server</modelDescription>'
+          '<modelName>Sonos One</modelName><modelURL>http://www.sonos.com/products/zoneplayers/S22</modelURL>'
+          '<UDN>uuid:RINCON_48A6B8D1E2F301400_MS</UDN>'
+          '<serviceList>' + ''.join(service(s, '/MediaServer') for s in MS_SERVICES) + '</serviceList></device>')
+    mr = ('<device><deviceType>urn:schemas-upnp-org:device:MediaRenderer:1</deviceType>'
+          '<friendlyName>Living Room - Sonos One</friendlyName>'
+          '<manufacturer>Sonos, Inc.</manufacturer><manufacturerURL>http://www.sonos.com</manufacturerURL>'
+          '<modelNumber>S22</modelNumber><modelDescription>Sonos One Media Renderer</modelDescription>'
+          '<modelName>Sonos One</modelName><modelURL>http://www.sonos.com/products/zoneplayers/S22</modelURL>'
+          '<UDN>uuid:RINCON_48A6B8D1E2F301400_MR</UDN>'
+          '<serviceList>' + ''.join(service(s, '/MediaRenderer') for s in MR_SERVICES) + '</serviceList>'
+          '<X_Rhapsody-Extension xmlns="http://www.real.com/rhapsody/xmlns/upnp-1-0">'
+          '<deviceID>urn:rhapsody-real-com:device-id-1-0:sonos_1:RINCON_48A6B8D1E2F301400</deviceID>'
+          '<deviceCapabilities><interactionPattern type="real-rhapsody-upnp-1-0"/></deviceCapabilities>'
+          '</X_Rhapsody-Extension><qq:X_QPlay_SoftwareCapability xmlns:qq="http://www.tencent.com">QPlay:2</qq:X_QPlay_SoftwareCapability>'
+          + icon + '</device>')
+    lines = [
+        '<?xml version="1.0" encoding="utf-8" ?>',
+        '<root xmlns="urn:schemas-upnp-org:device-1-0">',
+        '  <specVersion><major>1</major><minor>0</minor></specVersion>',
+        '  <device>',
+        '    <deviceType>urn:schemas-upnp-org:device:ZonePlayer:1</deviceType>',
+        '    <friendlyName>192.168.1.20 - Sonos One - RINCON_48A6B8D1E2F301400</friendlyName>',
+        '    <manufacturer>Sonos, Inc.</manufacturer>',
+        '    <manufacturerURL>http://www.sonos.com</manufacturerURL>',
+        '    <modelNumber>S22</modelNumber>',
+        '    <modelDescription>Sonos One</modelDescription>',
+        '    <modelName>Sonos One</modelName>',
+        '    <modelURL>http://www.sonos.com/products/zoneplayers/S22</modelURL>',
+        '    <softwareVersion>79.1-55010</softwareVersion>',
+        '    <swGen>2</swGen>',
+        '    <hardwareVersion>1.20.1.6-2.2</hardwareVersion>',
+        '    <serialNum>48-A6-B8-D1-E2-F3:7</serialNum>',
+        '    <MACAddress>48:A6:B8:D1:E2:F3</MACAddress>',
+        '    <UDN>uuid:RINCON_48A6B8D1E2F301400</UDN>',
+        '    ' + icon,
+        '    <minCompatibleVersion>78.0-00000</minCompatibleVersion>',
+        '    <legacyCompatibleVersion>58.0-00000</legacyCompatibleVersion>',
+        '    <apiVersion>1.40.1</apiVersion>',
+        '    <minApiVersion>1.1.0</minApiVersion>',
+        '    <displayVersion>16.2</displayVersion>',
+        '    <extraVersion></extraVersion>',
+        '    <nsVersion>1</nsVersion>',
+        '    <roomName>Living Room</roomName>',
+        '    <displayName>One</displayName>',
+        '    <zoneType>25</zoneType>',
+        '    <feature1>0x00000000</feature1>',
+        '    <feature2>0x00403332</feature2>',
+        '    <feature3>0x0003d112</feature3>',
+        '    <seriesid>A101</seriesid>',
+        '    <variant>2</variant>',
+        '    <internalSpeakerSize>3</internalSpeakerSize>',
+        '    <memory>512</memory>',
+        '    <flash>512</flash>',
+        '    <flashRepartitioned>1</flashRepartitioned>',
+        '    <ampOnTime>10</ampOnTime>',
+        '    <retailMode>0</retailMode>',
+        '    <SSLPort>1443</SSLPort>',
+        '    <securehhSSLPort>1843</securehhSSLPort>',
+        '    <serviceList>',
+    ]
+    lines += ['      ' + service(s) for s, _ in SERVICES]
+    lines += ['    </serviceList>', '    <deviceList>', '      ' + ms, '      ' + mr, '    </deviceList>', '  </device>', '</root>', '']
+    return '\n'.join(lines)
+
+
+CORPUS = {
+    'device_description.xml': device_description,
+    'propertyset_avtransport.xml': last_change_avtransport,
+    'propertyset_renderingcontrol.xml': last_change_rendering,
+    'get_position_info.xml': position_info,
+    'browse_10.xml': lambda: browse(10),
+    'browse_100.xml': lambda: browse(100),
+    'browse_1000.xml': lambda: browse(1000),
+}
+
+
+if __name__ == '__main__':
+    os.makedirs(OUT, exist_ok=True)
+    for name, make in CORPUS.items():
+        with open(os.path.join(OUT, name), 'w', encoding='utf-8') as f:
+            f.write(make())
@@ -0,0 +1,215 @@
+import asyncio
+import errno
+import random
+import struct
+import time
+import wifi
+from socketpool import SocketPool
+
+import reactor
+
+
+pool = SocketPool(wifi.radio)
+DNS_PORT = 53
+QUERY_TIMEOUT = 2
+QUERY_RETRIES = 2
+# clamp server-provided TTLs so a bad answer can't stick around forever
+# and a 0 TTL doesn't mean a query per request
+MIN_TTL = 5
+MAX_TTL = 3600
+# how long to remember that a name doesn't resolve
+NEGATIVE_TTL = 30
+MAX_CACHE_ENTRIES = 32
+
+QTYPE_A = 1
+QTYPE_CNAME = 5
+QCLASS_IN = 1
+RCODE_NXDOMAIN = 3
+
+# hostname: (ip or None, expires_at)
+_cache = {}
+# hostname: Event, for lookups that are already in flight
+_pending = {}
+
+
+class DNSError(OSError):
+    pass
+
+
+def is_ip(host):
+    parts = host.split('.')
+    if len(parts) != 4:
+        return False
+    for part in parts:
+        if not part.isdigit() or int(part) > 255:
+            return False
+    return True
+
+
+def _cache_get(hostname):
+    entry = _cache.get(hostname)
+    if entry is None:
+        return False, None
+    ip, expires_at = entry
+    if time.monotonic() > expires_at:
+        del _cache[hostname]
+        return False, None
+    return True, ip
+
+
+def _cache_put(hostname, ip, ttl):
+    if hostname not in _cache and len(_cache) >= MAX_CACHE_ENTRIES:
+        # evict whatever expires soonest
+        del _cache[min(_cache, key=lambda k: _cache[k][1])]
+    _cache[hostname] = (ip, time.monotonic() + ttl)
+
+
+def _build_query(qid, hostname):
+    query = bytearray(struct.pack('>HHHHHH', qid, 0x0100, 1, 0, 0, 0))
+    for label in hostname.split('.'):
+        query.append(len(label))
+        query += label.encode('ascii')
+    query += struct.pack('>BHH', 0, QTYPE_A, QCLASS_IN)
+    return query
+
+
+def _skip_name(msg, offset):
+    while True:
+        if offset >= len(msg):
+            raise DNSError(errno.EINVAL)
+        length = msg[offset]
+        if length & 0xc0 == 0xc0:
+            # compression pointer; the name ends here
+            return offset + 2
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+
+def _parse_response(msg, qid):
+    # returns (ip, ttl); ip is None if the name does not exist
+    # raises DNSError(EINVAL) for anything that isn't a well-formed response to qid
+    # (everything is bounds-checked; a truncated or mangled packet mustn't read past the end)
+    if len(msg) < 12:
+        raise DNSError(errno.EINVAL)
+    rid, flags, qdcount, ancount, _, _ = struct.unpack_from('>HHHHHH', msg)
+    if rid != qid or not flags & 0x8000:
+        raise DNSError(errno.EINVAL)
+    rcode = flags & 0xf
+    if rcode == RCODE_NXDOMAIN:
+        return None, NEGATIVE_TTL
+    elif rcode:
+        raise DNSError(errno.EIO)
+
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(msg, offset) + 4
+    if offset > len(msg):
+        raise DNSError(errno.EINVAL)
+
+    # CNAMEs come first in the answer section followed by the A record(s) they point to
+    # so the first A record is the one we want
+    for _ in range(ancount):
+        offset = _skip_name(msg, offset)
+        if offset + 10 > len(msg):
+            raise DNSError(errno.EINVAL)
+        rtype, rclass, ttl, rdlength = struct.unpack_from('>HHIH', msg, offset)
+        offset += 10
+        if offset + rdlength > len(msg):
+            raise DNSError(errno.EINVAL)
+        if rtype == QTYPE_A and rclass == QCLASS_IN and rdlength == 4:
+            ip = '.'.join(str(b) for b in msg[offset:offset + 4])
+            return ip, min(max(ttl, MIN_TTL), MAX_TTL)
+        offset += rdlength
+
+    # no A record (e.g. an IPv6-only name)
+    return None, NEGATIVE_TTL
+
+
+async def _sock():
+    s = None
+    while s is None:
+        try:
+            s = pool.socket(SocketPool.AF_INET, SocketPool.SOCK_DGRAM, SocketPool.IPPROTO_UDP)
+        except RuntimeError:
+            await asyncio.sleep_ms(100)
+    s.setblocking(False)
+    return s
+
+
+async def _query(server, hostname):
+    qid = random.randint(0, 0xffff)
+    query = _build_query(qid, hostname)
+    buf = bytearray(512)
+    sock = await _sock()
+    try:
+        for _ in range(QUERY_RETRIES + 1):
+            sock.sendto(query, (server, DNS_PORT))
+            deadline = time.monotonic() + QUERY_TIMEOUT
+            backoff = reactor.Backoff()
+            while time.monotonic() < deadline:
+                try:
+                    nbytes, (host, port) = sock.recvfrom_into(buf)
+                except OSError:
+                    await reactor.wait_readable(sock, backoff, timeout=max(0, deadline - time.monotonic()))
+                    continue
+                if host != server:
+                    continue
+                try:
+                    return _parse_response(memoryview(buf)[:nbytes], qid)
+                except DNSError as e:
+                    if e.errno == errno.EINVAL:
+                        # not the response to our query (late reply to an old one?) or malformed; drop it
+                        continue
+                    raise
+    finally:
+        sock.close()
+    raise DNSError(errno.ETIMEDOUT)
+
+
+def _dns_server():
+    server = wifi.radio.ipv4_dns
+    if server is None:
+        return None
+    server = str(server)
+    if server == '0.0.0.0':
+        return None
+    return server
+
+
+async def resolve(hostname):
+    # returns the IPv4 address of hostname as a string
+    # IP literals (like the players' addresses) are returned as-is
+    if is_ip(hostname):
+        return hostname
+    hostname = hostname.lower()
+
+    while True:
+        cached, ip = _cache_get(hostname)
+        if cached:
+            if ip is None:
+                raise DNSError(errno.ENOENT)
+            return ip
+        # someone else is already looking this name up; wait for their answer
+        if hostname not in _pending:
+            break
+        await _pending[hostname].wait()
+
+    _pending[hostname] = done = asyncio.Event()
+    try:
+        server = _dns_server()
+        if server is None:
+            # no resolver address from DHCP; fall back to the (blocking) socketpool resolver
+            *_, (ip, _) = pool.getaddrinfo(hostname, DNS_PORT)[0]
+            ttl = MIN_TTL
+        else:
+            ip, ttl = await _query(server, hostname)
+        _cache_put(hostname, ip, ttl)
+    finally:
+        del _pending[hostname]
+        done.set()
+
+    if ip is None:
+        raise DNSError(errno.ENOENT)
+    return ip
@@ -11,12 +11,43 @@ from adafruit_datetime import datetime
 from collections import namedtuple
 from socketpool import SocketPool
 
+import adns
 import babyxml
+import lru
+from timing import RequestTiming, TimingStats
+import reactor
 
 
 DEBUG = os.getenv('DEBUG_AHTTP') in {'1', '2'}
 DEBUG2 = os.getenv('DEBUG_AHTTP') == '2'
 DEFAULT_TIMEOUT = 60
+# how long an idle keep-alive connection is kept around for reuse
+KEEPALIVE_IDLE_TIMEOUT = 15
+# maximum number of concurrent (and pooled) connections per host
+KEEPALIVE_MAX_PER_HOST = 4
+# connections to a host beyond KEEPALIVE_MAX_PER_HOST that only interactive requests may use,
+# so a button press doesn't queue behind background requests to the same player
+KEEPALIVE_RESERVED_PER_HOST = 1
+# response cache limits (see Cache)
+CACHE_MAX_SIZE = 256 * 1024
+CACHE_MAX_ENTRIES = 16
+CACHE_MAX_SPILLED = 64
+# size of the receive buffers shared between requests
+RECV_BUF_SIZE = 1024
+# number of TCP sockets ahttp may hold at once (open or pooled), leaving the rest of the
+# socket pool to the callback server, SSDP and DNS
+SOCKET_BUDGET = 6
+# sockets only interactive requests may use, so a user's button press never waits on background work
+SOCKET_BUDGET_RESERVED = 1
+
+# requests that can just be sent again if a pooled connection turns out to be dead
+# (SUBSCRIBE only when it's a renewal, see _idempotent; a second new subscription isn't harmless)
+IDEMPOTENT_VERBS = {'GET', 'HEAD'}
+
+# request priorities, most urgent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_EVENTS = 1
+PRIORITY_BACKGROUND = 2
 
 pool = SocketPool(wifi.radio)
 ssl_context = ssl.create_default_context()
@@ -24,11 +55,15 @@ ssl_context = ssl.create_default_context()
 
 async def _sock():
     s = None
+    backoff = None
     while s is None:
         try:
             s = pool.socket(SocketPool.AF_INET, SocketPool.SOCK_STREAM, SocketPool.IPPROTO_TCP)
         except RuntimeError:
-            await asyncio.sleep_ms(100)
+            # the budget keeps ahttp itself in check but sockets used elsewhere can still run the pool dry
+            if backoff is None:
+                backoff = reactor.Backoff(initial_ms=10)
+            await backoff.wait()
     s.setsockopt(SocketPool.SOL_SOCKET, SocketPool.SO_REUSEADDR, 1)
     # CircuitPython >= 9.1.0: setting a TCP socket to non-blocking
     # before connecting does not work right
@@ -65,38 +100,121 @@ SCHEME_DEFAULT_PORTS = {
 TEXT_MIMES = {
     'application/json',
 }
+# charsets babyxml can parse straight from the raw body; None because XML defaults to utf-8
+UTF8_CHARSETS = {
+    None,
+    'utf-8',
+    'utf8',
+    'us-ascii',
+    'ascii',
+}
 
 Request = namedtuple('Request', ['verb', 'url', 'headers'])
 
 
 
+def _charset(headers):
+    # the charset parameter of the content-type, if there is one
+    _, *params = headers.get('content-type', 'application/octet-stream').split(';')
+    for param in params:
+        name, _, val = param.partition('=')
+        if name.strip() == 'charset':
+            return val.strip().strip('"').lower()
+    return None
+
+
+def _decode_body(headers, body):
+    content_mime = headers.get('content-type', 'application/octet-stream').split(';')[0]
+    charset = _charset(headers)
+    if charset is None and (content_mime.startswith('text/') or content_mime in TEXT_MIMES):
+        charset = 'latin-1'
+    if charset:
+        body = body.decode(charset)
+    return body
+
+
 class Response:
-    def __init__(self, request, status_code, reason, headers, body):
+    def __init__(self, request, status_code, reason, headers, content, reader=None, on_body=None):
         self.request = request
         self.status_code = status_code
         self.reason = reason
         self.headers = headers
-        self.body = body
+        # the raw body; it's only decoded to str if .body is used
+        self.content = content
+        self._body = None
+        self._reader = reader
+        # called with the raw body once a streamed body has been read in full (used to fill the cache)
+        self._on_body = on_body
         self._json = None
         self._xml = None
 
     @classmethod
     def from_response(cls, request, httpver, status_code, reason, headers, body):
-        content_mime, *params = headers.get('content-type', 'application/octet-stream').split(';')
-        charset = None
-        if content_mime.startswith('text/') or content_mime in TEXT_MIMES:
-            charset = 'latin-1'
-        for param in params:
-            name, val = param.split('=')
-            if name == 'charset':
-                charset = val
-        if charset:
-            body = body.decode(charset)
         return cls(request, int(status_code), reason, headers, body)
 
     def __repr__(self):
         return f'<Response status_code={self.status_code} {self.reason}>'
 
+    @property
+    def body(self):
+        # the body decoded according to its content-type
+        if self._body is None and self.content is not None:
+            self._body = _decode_body(self.headers, self.content)
+        return self._body
+
+    @property
+    def streaming(self):
+        return self._reader is not None
+
+    # streaming API (request(..., stream=True))
+    # the body is left on the wire until it is consumed with exactly one of these
+    # they also work on responses that were never streamed (e.g. ones answered from the cache)
+    def iter_chunks(self):
+        # async iterator over body chunks as they arrive
+        # each chunk is only valid until the next one is read
+        return self._reader
+
+    def _body_done(self, reader, body):
+        if self._on_body is not None and reader.complete:
+            self._on_body(body)
+
+    async def read(self):
+        # read the rest of a streamed body into memory
+        if self._reader is not None:
+            reader, self._reader = self._reader, None
+            self.content = await _read_body(reader)
+            self._body_done(reader, self.content)
+        return self.body
+
+    async def readinto(self, buf):
+        # read a streamed body straight into buf; returns the number of bytes written
+        view = memoryview(buf)
+        if self._reader is None:
+            view[:len(self.content)] = self.content
+            return len(self.content)
+        reader, self._reader = self._reader, None
+        nbytes = await reader.readinto(view)
+        self._body_done(reader, buf if nbytes == len(buf) else view[:nbytes])
+        return nbytes
+
+    async def write_to(self, f):
+        # write a streamed body to a file-like object; returns the number of bytes written
+        if self._reader is None:
+            f.write(self.content)
+            return len(self.content)
+        reader, self._reader = self._reader, None
+        nbytes = 0
+        async for chunk in reader:
+            f.write(chunk)
+            nbytes += len(chunk)
+        return nbytes
+
+    def close(self):
+        # give up on the rest of a streamed body
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
     # TODO: awaitable versions of these?
     def json(self):
         if 'json' in self.headers.get('content-type'):
@@ -107,57 +225,388 @@ class Response:
     def xml(self):
         if 'xml' in self.headers.get('content-type'):
             if not self._xml:
-                self._xml = babyxml.xmltodict(self.body)
+                # babyxml parses utf-8 bytes as they are, which saves holding a decoded copy too
+                if _charset(self.headers) in UTF8_CHARSETS:
+                    self._xml = babyxml.parse(self.content)
+                else:
+                    self._xml = babyxml.parse(self.body)
             return self._xml
 
 
-def dns_lookup(url_parsed):
-    # TODO: async DNS
+class CacheEntry:
+    def __init__(self, headers, body=None, path=None):
+        self.headers = headers
+        # body is kept in RAM, or spilled to a file at path
+        self.body = body
+        self.path = path
+
+
+class Cache:
+    # conditional-request cache for GETs, keyed by URL
+    # responses with an ETag or Last-Modified are kept in a size-bounded LRU in RAM and revalidated
+    # with If-None-Match/If-Modified-Since; a 304 is answered with the cached body.
+    # if spill_dir is set, entries evicted from RAM are written there instead of being dropped
+    def __init__(self, max_size=CACHE_MAX_SIZE, max_entries=CACHE_MAX_ENTRIES, spill_dir=None, max_spilled=CACHE_MAX_SPILLED):
+        self.spill_dir = spill_dir
+        self.revalidations = 0
+        self._ram = lru.LRU(max_entries, max_size, on_evict=self._spill)
+        self._flash = None
+        self._spill_seq = 0
+        # spill_dir is set up on the first spill rather than here: the cache is created on import,
+        # before PlayerManager.init_storage() has remounted / writable
+        self._spill_dir_ready = False
+        if spill_dir:
+            self._flash = lru.LRU(max_spilled, on_evict=self._unlink)
+
+    def _init_spill_dir(self):
+        # returns whether spill_dir is ready; if not, it's tried again on the next spill
+        try:
+            os.mkdir(self.spill_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                # most likely / is still read-only
+                print(f'[{datetime.now()}] cache spill dir {self.spill_dir} unavailable {type(e)}({e})')
+                return False
+        # spilled entries don't survive a restart; clear out any leftovers
+        try:
+            for name in os.listdir(self.spill_dir):
+                os.remove(f'{self.spill_dir}/{name}')
+        except OSError as e:
+            print(f'[{datetime.now()}] cache spill dir {self.spill_dir} unavailable {type(e)}({e})')
+            return False
+        return True
+
+    def _spill(self, url, entry):
+        if self._flash is None:
+            return
+        if not self._spill_dir_ready:
+            self._spill_dir_ready = self._init_spill_dir()
+            if not self._spill_dir_ready:
+                return
+        self._spill_seq += 1
+        path = f'{self.spill_dir}/{self._spill_seq:08x}'
+        try:
+            with open(path, 'wb') as f:
+                f.write(entry.body)
+        except OSError as e:
+            print(f'[{datetime.now()}] cache spill failed {type(e)}({e})')
+            return
+        self._flash.put(url, CacheEntry(entry.headers, path=path))
+
+    @staticmethod
+    def _unlink(url, entry):
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+    def _lookup(self, url):
+        entry = self._ram.get(url)
+        if entry is None and self._flash is not None:
+            entry = self._flash.get(url)
+        return entry
+
+    @staticmethod
+    def cacheable(status_code, headers):
+        if status_code != 200:
+            return False
+        if 'no-store' in headers.get('cache-control', ''):
+            return False
+        return 'etag' in headers or 'last-modified' in headers
+
+    def prepare(self, url, headers):
+        # add validators for our copy of url (if any) to the request headers
+        entry = self._lookup(url)
+        if entry is not None:
+            if 'etag' in entry.headers:
+                headers['If-None-Match'] = entry.headers['etag']
+            if 'last-modified' in entry.headers:
+                headers['If-Modified-Since'] = entry.headers['last-modified']
+        return entry
+
+    def revalidated(self, url, entry, headers):
+        # the server answered 304 Not Modified; returns the cached headers and body
+        # or None if the copy has gone in the meantime and has to be fetched again
+        if entry.body is None:
+            # spilled to flash; read it back and promote it to RAM
+            # unless it was evicted (or replaced by a store) while the request was in flight
+            if self._flash.get(url) is not entry:
+                return None
+            self._flash.pop(url)
+            try:
+                with open(entry.path, 'rb') as f:
+                    body = f.read()
+            except OSError as e:
+                print(f'[{datetime.now()}] cache spill read failed {type(e)}({e})')
+                return None
+            finally:
+                self._unlink(url, entry)
+            entry = CacheEntry(entry.headers, body)
+            self._ram.put(url, entry, len(body))
+
+        self.revalidations += 1
+        for name in ('etag', 'last-modified', 'date', 'expires', 'cache-control'):
+            if name in headers:
+                entry.headers[name] = headers[name]
+        return entry.headers, entry.body
+
+    def store(self, url, headers, body):
+        # bytes/bytearray bodies are kept as they are rather than copied (the album art is read into a
+        # buffer of its own that would otherwise be held twice); they mustn't be modified afterwards
+        if self._flash is not None and url in self._flash:
+            self._unlink(url, self._flash.pop(url))
+        if not isinstance(body, (bytes, bytearray)):
+            body = bytes(body)
+        entry = CacheEntry(headers, body)
+        if not self._ram.put(url, entry, len(entry.body)):
+            # too big to keep in RAM at all
+            self._spill(url, entry)
+
+    def stats(self):
+        return {
+            'ram': self._ram.stats(),
+            'flash': self._flash.stats() if self._flash is not None else None,
+            'revalidations': self.revalidations,
+        }
+
+
+cache = Cache(spill_dir=os.getenv('AHTTP_CACHE_SPILL_DIR'))
+
+
+async def dns_lookup(url_parsed):
     hostname = url_parsed.netloc
     port = SCHEME_DEFAULT_PORTS.get(url_parsed.scheme)
     if ':' in hostname:
         hostname, port = hostname.split(':')
         port = int(port)
 
-    *_, (host, port) = pool.getaddrinfo(hostname, port)[0]
+    host = await adns.resolve(hostname)
     return host, port
 
 
-reqs_in_flight = set()
+class ConnectionClosed(OSError):
+    pass
 
-async def request(verb, url, headers, body=None):
-    if DEBUG:
-        tag = f'{random.randint(0x1000, 0xffff):04x}'
-        reqs_in_flight.add(tag)
 
-    # parse URL
-    url_parsed = urlparse(url)
-    # DNS lookup
-    host, port = dns_lookup(url_parsed)
-    
-    # basic/auto headers
-    headers['Connection'] = 'close'
-    headers['Host'] = url_parsed.netloc.lower()
-    if body:
-        headers['Content-Length'] = len(body)
+class SocketBudget:
+    # hands out the right to open a socket from a fixed budget instead of everyone busy-retrying
+    # pool.socket() when it runs dry. waiters are served highest priority first, FIFO within a priority,
+    # and the last SOCKET_BUDGET_RESERVED sockets are kept for interactive requests
+    # (ConnectionPool also uses one per host to hand out that host's connection slots)
+    def __init__(self, limit=SOCKET_BUDGET, reserved=SOCKET_BUDGET_RESERVED):
+        self.limit = limit
+        self.reserved = reserved
+        self.in_use = 0
+        # called when a request would have to wait; should free up a socket if it can
+        self.reclaim = None
+        # one FIFO of waiters per priority; a waiter is [Event, granted]
+        self._waiters = ([], [], [])
 
-    # informational context for the response object
-    request_info = Request(verb, url, headers)
+    def _available(self, priority):
+        limit = self.limit
+        if priority != PRIORITY_INTERACTIVE:
+            limit -= self.reserved
+        return self.in_use < limit
 
-    # format the raw request
-    request_lines = [
-        f'{verb.upper()} {url_parsed.path} HTTP/1.1',
-    ]
-    request_lines.extend(f'{header_name}: {header_value}' for header_name, header_value in headers.items())
-    if body:
-        request_lines.append('')
-        request_lines.extend(body.splitlines())
-    else:
-        request_lines.extend(('', ''))
-    request_raw = '\r\n'.join(request_lines).encode('utf-8')
+    def _queued_ahead(self, priority):
+        return any(self._waiters[p] for p in range(priority + 1))
+
+    async def acquire(self, priority=PRIORITY_BACKGROUND):
+        if not self._available(priority) and self.reclaim is not None:
+            # give up an idle pooled connection rather than wait on one to free up
+            self.reclaim()
+        if self._available(priority) and not self._queued_ahead(priority):
+            self.in_use += 1
+            return
+
+        waiter = [asyncio.Event(), False]
+        self._waiters[priority].append(waiter)
+        try:
+            await waiter[0].wait()
+        except BaseException:
+            if waiter[1]:
+                # granted just as we gave up
+                self.release()
+            else:
+                self._waiters[priority].remove(waiter)
+            raise
+
+    @property
+    def contended(self):
+        return any(self._waiters)
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def _wake(self):
+        for priority, waiters in enumerate(self._waiters):
+            while waiters and self._available(priority):
+                waiter = waiters.pop(0)
+                waiter[1] = True
+                self.in_use += 1
+                waiter[0].set()
+            if waiters:
+                # don't let lower priorities jump the queue
+                break
+
+    def stats(self):
+        return {
+            'in_use': self.in_use,
+            'limit': self.limit,
+            'waiting': [len(waiters) for waiters in self._waiters],
+        }
+
+
+budget = SocketBudget()
+
+
+class Connection:
+    # a socket budget slot and (once connected) the socket using it
+    def __init__(self, key, sock=None):
+        self.key = key
+        self.sock = sock
+        self.has_slot = True
+        self.last_used = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.sock is not None
+
+    def close(self, keep_slot=False):
+        # keep_slot to reconnect without going back through the budget
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.has_slot and not keep_slot:
+            self.has_slot = False
+            budget.release()
+
+
+class ConnectionPool:
+    def __init__(self, idle_timeout=KEEPALIVE_IDLE_TIMEOUT, max_per_host=KEEPALIVE_MAX_PER_HOST):
+        self.idle_timeout = idle_timeout
+        self.max_per_host = max_per_host
+        # (scheme, host, port): [Connection, ...]
+        self._idle = {}
+        # (scheme, host, port): SocketBudget of connection slots for that host
+        self._slots = {}
+
+    def prune(self):
+        now = time.monotonic()
+        for key, idle in self._idle.items():
+            while idle and (now - idle[0].last_used) > self.idle_timeout:
+                idle.pop(0).close()
+
+    def _host_slots(self, key):
+        slots = self._slots.get(key)
+        if slots is None:
+            slots = self._slots[key] = SocketBudget(
+                self.max_per_host + KEEPALIVE_RESERVED_PER_HOST,
+                KEEPALIVE_RESERVED_PER_HOST,
+            )
+        return slots
+
+    async def acquire(self, key, priority=PRIORITY_BACKGROUND):
+        # wait for a free slot for this host, in priority order
+        slots = self._host_slots(key)
+        await slots.acquire(priority)
+
+        # reuse the most recently used idle connection, if it's still warm
+        self.prune()
+        idle = self._idle.get(key)
+        if idle:
+            return idle.pop()
+
+        # otherwise we need a new socket
+        try:
+            await budget.acquire(priority)
+        except BaseException:
+            slots.release()
+            raise
+        return Connection(key)
+
+    def reclaim(self):
+        # close the least recently used idle connection (to any host); returns whether there was one
+        oldest = None
+        for idle in self._idle.values():
+            if idle and (oldest is None or idle[0].last_used < oldest[0].last_used):
+                oldest = idle
+        if oldest is None:
+            return False
+        oldest.pop(0).close()
+        return True
+
+    def release(self, conn, reusable=True):
+        key = conn.key
+        # don't sit on an idle socket while someone is waiting for one
+        if reusable and conn.is_open and not budget.contended:
+            conn.last_used = time.monotonic()
+            idle = self._idle.setdefault(key, [])
+            idle.append(conn)
+            if len(idle) > self.max_per_host:
+                idle.pop(0).close()
+        else:
+            conn.close()
+        self._slots[key].release()
+
+    def close(self):
+        for idle in self._idle.values():
+            while idle:
+                idle.pop().close()
+
+
+connections = ConnectionPool()
+budget.reclaim = connections.reclaim
+
+
+def _action(verb, headers):
+    # SOAP calls are tracked by action (e.g. SetVolume), everything else by HTTP verb
+    soap_action = headers.get('SOAPACTION')
+    if soap_action:
+        return soap_action.rpartition('#')[2]
+    return verb
+
+
+class Stats:
+    # rolling per-host and per-action request timings
+    # hooks are called with the RequestTiming of every finished (or failed) request
+    def __init__(self, window=32):
+        self.window = window
+        self.by_host = {}
+        self.by_action = {}
+        self._hooks = []
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def record(self, timing):
+        timing.finish()
+        for registry, key in ((self.by_host, timing.host), (self.by_action, timing.action)):
+            if key not in registry:
+                registry[key] = TimingStats(self.window)
+            registry[key].add(timing)
+        for hook in self._hooks:
+            try:
+                hook(timing)
+            except Exception as e:
+                print(f'[{datetime.now()}] timing hook failed {type(e).__name__}({e})')
+
+    def summary(self):
+        return {
+            'hosts': {host: s.summary() for host, s in self.by_host.items()},
+            'actions': {action: s.summary() for action, s in self.by_action.items()},
+        }
+
+
+stats = Stats()
+reqs_in_flight = set()
 
 
-    resp = None
+async def _connect(url_parsed, host, port, request_raw, tag=None, timing=None):
     sock = await _sock()
     if url_parsed.scheme == 'https':
         sock = ssl_context.wrap_socket(sock)
@@ -166,8 +615,11 @@ async def request(verb, url, headers, body=None):
     if DEBUG2:
         print(f'[{datetime.now()}]{tag}_{host}:{port} Connecting...')
         st = time.monotonic()
+    backoff = reactor.Backoff()
     while True:
         try:
+            if timing is not None:
+                timing.connect_attempts += 1
             sock.connect((host, port))
         except OSError as e:
             # print(f'[{datetime.now()}]{tag}_{host}:{port} {e}')
@@ -184,12 +636,13 @@ async def request(verb, url, headers, body=None):
                 continue
             elif e.errno in {errno.EINPROGRESS, errno.EALREADY, errno.ETIMEDOUT, errno.EAGAIN}:
                 if DEBUG:
-                    print(f'[{datetime.now()}]{tag}_{host}:{port} connection error {e}; sleep 250ms ({len(reqs_in_flight) - 1} other connections live)')
+                    print(f'[{datetime.now()}]{tag}_{host}:{port} connection error {e}; waiting ({len(reqs_in_flight) - 1} other connections live)')
                 # EINPROGRESS - connection is currently in progress
                 # EALREADY - already connecting
                 # ETIMEDOUT - operation timed out
                 # EAGAIN - try again
-                await asyncio.sleep_ms(250)
+                # the socket becomes writable once the connection is established
+                await reactor.wait_writable(sock, backoff)
                 continue
             elif e.errno == 127:
                 # EISCONN - already connected
@@ -220,55 +673,249 @@ async def request(verb, url, headers, body=None):
                 print(f'[{datetime.now()}]{tag}_{host}:{port} send success ({time.monotonic() - st}s)')
             await asyncio.sleep(0)
             # post-send await point for concurrency
-            break
-
-    # await the response
-    # read status line and headers
-    # this often also starts to read the body
-    status, headers, body_buf = await _read_headers(sock)
-    httpver, status_code, reason = status.split(' ', 2)
-    status_code = int(status_code)
-    # read the rest of the body
-    body_buf = await _read_body(sock, body_buf, status_code, headers)
+            return sock
+
+
+def _idempotent(verb, headers):
+    return verb in IDEMPOTENT_VERBS or (verb == 'SUBSCRIBE' and 'SID' in headers)
+
+
+_probe_buf = bytearray(1)
+
+
+def _peer_closed(sock):
+    # an idle pooled socket has nothing to read, so anything but EAGAIN from a read
+    # (EOF, a reset, stray bytes) means it's no use anymore
+    try:
+        sock.recv_into(_probe_buf, 1)
+    except OSError as e:
+        return e.errno not in {errno.EAGAIN, 11}
+    return True
+
+
+async def _send(conn, url_parsed, host, port, request_raw, tag=None, timing=None, probe=False):
+    # try the warm socket first; if the other side has hung up on it, start over with a fresh one
+    # probe: check it hasn't been hung up on before sending, for requests that can't be retried
+    # once they've been sent
+    if conn.is_open and probe and _peer_closed(conn.sock):
+        if DEBUG:
+            print(f'[{datetime.now()}]{tag}_{host}:{port} pooled connection closed by peer; reconnect')
+        conn.close(keep_slot=True)
+    if conn.is_open:
+        try:
+            conn.sock.send(request_raw)
+        except OSError as e:
+            if DEBUG:
+                print(f'[{datetime.now()}]{tag}_{host}:{port} stale connection {type(e)}({e}); reconnect')
+            conn.close(keep_slot=True)
+        else:
+            await asyncio.sleep(0)
+            return True
+    conn.sock = await _connect(url_parsed, host, port, request_raw, tag, timing)
+    return False
+
+
+def _keep_alive(httpver, headers):
+    connection = headers.get('connection', '').lower()
+    if httpver == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+
+async def request(verb, url, headers, body=None, stream=False, cache=None, priority=PRIORITY_BACKGROUND):
+    tag = None
+    if DEBUG:
+        tag = f'{random.randint(0x1000, 0xffff):04x}'
+        reqs_in_flight.add(tag)
+
+    # parse URL
+    url_parsed = urlparse(url)
+
+    # bodies go out as-is; only str bodies need encoding
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+
+    # basic/auto headers
+    headers['Connection'] = 'keep-alive'
+    headers['Host'] = url_parsed.netloc.lower()
+    if body:
+        headers['Content-Length'] = len(body)
+
+    # conditional request if we have a cached copy
+    cached = None
+    if cache is not None and verb == 'GET':
+        cached = cache.prepare(url, headers)
+
+    # informational context for the response object
+    request_info = Request(verb, url, headers)
+
+    # format the raw request
+    request_lines = [
+        f'{verb.upper()} {url_parsed.path} HTTP/1.1',
+    ]
+    request_lines.extend(f'{header_name}: {header_value}' for header_name, header_value in headers.items())
+    request_lines.extend(('', ''))
+    request_raw = '\r\n'.join(request_lines).encode('utf-8')
+    if body:
+        # send the head and body in one go so they share a segment
+        request_raw = bytearray(request_raw)
+        request_raw += body
+
+    timing = RequestTiming(verb, url_parsed.netloc, _action(verb, headers))
+    host = conn = None
+    try:
+        # DNS lookup
+        host, port = await dns_lookup(url_parsed)
+        timing.lap('dns')
+        conn = await connections.acquire((url_parsed.scheme, host, port), priority)
+        timing.lap('acquire')
+        # a request that isn't idempotent might have been carried out already when its connection
+        # closes without an answer, so it isn't sent again; the pooled socket is checked up front instead
+        idempotent = _idempotent(verb, headers)
+        reused = timing.reused = await _send(conn, url_parsed, host, port, request_raw, tag, timing, not idempotent)
+        timing.lap('connect')
+
+        # await the response
+        # read status line and headers
+        # this often also starts to read the body
+        try:
+            status, headers, body_buf = await _read_headers(conn.sock)
+        except ConnectionClosed:
+            if not reused or not idempotent:
+                raise
+            # the pooled connection went stale while it was idle; retry once on a fresh socket
+            if DEBUG:
+                print(f'[{datetime.now()}]{tag}_{host}:{port} pooled connection closed by peer; reconnect')
+            conn.close(keep_slot=True)
+            timing.reused = False
+            await _send(conn, url_parsed, host, port, request_raw, tag, timing)
+            status, headers, body_buf = await _read_headers(conn.sock)
+        httpver, status_code, reason = status.split(' ', 2)
+        status_code = timing.status_code = int(status_code)
+        timing.lap('ttfb')
+    except BaseException as e:
+        if host is None:
+            # failed lookups count towards the dns latency too
+            timing.lap('dns')
+        if conn is not None:
+            connections.release(conn, False)
+        timing.error = type(e).__name__
+        stats.record(timing)
+        raise
+
+    # the connection goes back to the pool once the body has been consumed
+    keep_alive = _keep_alive(httpver, headers)
+
+    def on_done(complete):
+        connections.release(conn, complete and keep_alive)
+        timing.lap('body')
+        stats.record(timing)
+
+    reader = BodyReader(conn.sock, body_buf, status_code, headers, on_done=on_done)
 
     if DEBUG:
         reqs_in_flight.remove(tag)
 
+    if cached is not None and status_code == 304:
+        # not modified; answer from the cache
+        await _read_body(reader)
+        revalidated = cache.revalidated(url, cached, headers)
+        if revalidated is not None:
+            headers, body_buf = revalidated
+            return Response.from_response(request_info, httpver, 200, 'OK', headers, body_buf)
+        # our copy went away while the request was in flight; fetch the whole thing
+        request_headers = request_info.headers
+        request_headers.pop('If-None-Match', None)
+        request_headers.pop('If-Modified-Since', None)
+        return await request(verb, url, request_headers, body, stream, cache, priority)
+
+    on_body = None
+    if cache is not None and verb == 'GET' and cache.cacheable(status_code, headers):
+        on_body = lambda body: cache.store(url, headers, body)
+
+    if stream:
+        return Response(request_info, status_code, reason, headers, None, reader, on_body)
+
+    # read the rest of the body
+    body_buf = await _read_body(reader)
+    if on_body is not None and reader.complete:
+        on_body(body_buf)
     return Response.from_response(request_info, httpver, status_code, reason, headers, body_buf)
 
 
-async def _aread(read_buf, buf, sock):
+class BufferPool:
+    # receive buffers are recycled between requests instead of being reallocated
+    # (and fragmenting the heap) on every read
+    def __init__(self, size=RECV_BUF_SIZE, max_free=4):
+        self.size = size
+        self.max_free = max_free
+        self._free = []
+
+    def acquire(self):
+        if self._free:
+            return self._free.pop()
+        return bytearray(self.size)
+
+    def release(self, buf):
+        if len(buf) == self.size and len(self._free) < self.max_free:
+            self._free.append(buf)
+
+
+buffers = BufferPool()
+
+
+async def _arecv_into(sock, view):
+    # read straight into view; returns the number of bytes read, or 0 if the other side closed the connection
+    backoff = None
     while True:
         try:
-            read_nbytes = sock.recv_into(read_buf, len(read_buf))
+            return sock.recv_into(view, len(view))
         except OSError as e:
-            if e.errno == 128:
+            if e.errno in {errno.ENOTCONN, errno.ECONNRESET, 128}:
                 # ENOTCONN - other side closed the connection
-                sock.close()
+                # ECONNRESET - other side reset the connection
                 return 0
             elif e.errno != 11:
                 # not EAGAIN
                 print('READ', repr(e), errno.errorcode.get(e.errno))
-            await asyncio.sleep_ms(100)
-        else:
-            buf += read_buf[:read_nbytes]
-            read_buf[:read_nbytes] = b'\x00' * read_nbytes
-            return read_nbytes
+            if backoff is None:
+                backoff = reactor.Backoff()
+            await reactor.wait_readable(sock, backoff)
 
 
 async def _read_headers(sock):
-    read_buf = bytearray(64)
-    headers_buf = bytearray()
+    headers_buf = buffers.acquire()
+    nbytes = 0
+    end = -1
 
     # try to read all headers
-    while b'\r\n\r\n' not in headers_buf:
-        await _aread(read_buf, headers_buf, sock)
+    while end < 0:
+        if nbytes == len(headers_buf):
+            # headers don't fit in one receive buffer; grow (this is rare)
+            grown = bytearray(2 * len(headers_buf))
+            grown[:nbytes] = headers_buf
+            buffers.release(headers_buf)
+            headers_buf = grown
+        read_nbytes = await _arecv_into(sock, memoryview(headers_buf)[nbytes:])
+        if read_nbytes == 0:
+            buffers.release(headers_buf)
+            if nbytes:
+                # it closed partway through the response, so the request was handled; don't retry it
+                raise OSError(errno.ECONNRESET)
+            # the other side closed the connection before responding
+            raise ConnectionClosed(errno.ENOTCONN)
+        # only search the new bytes (plus enough of the old ones to catch a split terminator)
+        end = headers_buf.find(b'\r\n\r\n', max(0, nbytes - 3), nbytes + read_nbytes)
+        nbytes += read_nbytes
         # concurrency point
         await asyncio.sleep(0)
 
-    header, body = headers_buf.split(b'\r\n\r\n', 1)
     # parse status and header lines
-    status, *header_lines = header.decode('latin-1').split('\r\n')
+    status, *header_lines = headers_buf[:end].decode('latin-1').split('\r\n')
+    # hang on to whatever we've read of the body so far
+    body = headers_buf[end + 4:nbytes]
+    buffers.release(headers_buf)
+
     headers = {}
     for header_line in header_lines:
         header_name, header_value = header_line.split(': ')
@@ -285,62 +932,244 @@ async def _read_headers(sock):
     return status, headers, body
 
 
-async def _read_body(sock, body_buf, status_code, headers):
-    # read body
-    if 'chunked' in headers.get('transfer-encoding', ''):
-        # raise NotImplementedError('transfer-encoding: chunked')
-        # reset body_buf and sync up with whatever we've read so far
-        already_read, body_buf = body_buf, bytearray()
-        while True:
-            # try to read the next chunk size
-            while b'\r\n' not in already_read:
-                next_read_buf = bytearray(16)
-                await _aread(next_read_buf, already_read, sock)
+class BodyReader:
+    # async iterator over a response body as it comes off the wire
+    # chunks are memoryviews into a shared receive buffer, so each one is only valid until the next is read
+    def __init__(self, sock, already_read, status_code, headers, on_done=None):
+        self.sock = sock
+        # set once the body has been read; complete is True if the response was framed
+        # well enough to leave the connection in a reusable state
+        self.done = False
+        self.complete = False
+        self._on_done = on_done
+        self._already_read = already_read
+        self._buf = None
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '')
+        self._decoder = ChunkedDecoder() if self._chunked else None
+        if status_code in {204, 304}:
+            self._remaining = 0
+        elif 'content-length' in headers:
+            self._remaining = int(headers['content-length'])
+        else:
+            # if there's no content-length (and it isn't chunked), the body ends
+            # when the other side closes the connection
+            self._remaining = None
+
+    @property
+    def length(self):
+        # total body length if it's known up front, otherwise None
+        if self._chunked or self._remaining is None:
+            return None
+        return self._remaining
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.done:
+            raise StopAsyncIteration
+        try:
+            if self._chunked:
+                chunk = await self._next_chunk()
+            else:
+                chunk = await self._next_read()
+        except StopAsyncIteration:
+            raise
+        except BaseException:
+            self.close()
+            raise
+        # concurrency point
+        await asyncio.sleep(0)
+        return chunk
+
+    async def readinto(self, view):
+        # read the (rest of the) body directly into view; returns the number of bytes written
+        nbytes = 0
+        if self.length is None:
+            async for chunk in self:
+                end = nbytes + len(chunk)
+                if end > len(view):
+                    self.close()
+                    raise ValueError('response body does not fit in buffer')
+                view[nbytes:end] = chunk
+                nbytes = end
+            return nbytes
+
+        if self.length > len(view):
+            self.close()
+            raise ValueError('response body does not fit in buffer')
+        try:
+            if self._already_read:
+                nbytes = min(len(self._already_read), self._remaining)
+                view[:nbytes] = self._already_read[:nbytes]
+                self._already_read = None
+                self._remaining -= nbytes
+            while self._remaining > 0:
+                read_nbytes = await _arecv_into(self.sock, view[nbytes:nbytes + self._remaining])
+                if read_nbytes == 0:
+                    # truncated response
+                    self.close()
+                    return nbytes
+                nbytes += read_nbytes
+                self._remaining -= read_nbytes
+                # concurrency point
                 await asyncio.sleep(0)
+        except BaseException:
+            self.close()
+            raise
+        try:
+            self._finish(True)
+        except StopAsyncIteration:
+            pass
+        return nbytes
+
+    def _finish(self, complete):
+        if not self.done:
+            self.done = True
+            self.complete = complete
+            if self._buf is not None:
+                buffers.release(self._buf)
+                self._buf = None
+            if self._on_done is not None:
+                self._on_done(complete)
+        raise StopAsyncIteration
+
+    def close(self):
+        try:
+            self._finish(False)
+        except StopAsyncIteration:
+            pass
+
+    async def _recv(self, limit=None):
+        # read into the shared receive buffer
+        if self._buf is None:
+            self._buf = buffers.acquire()
+        view = memoryview(self._buf)
+        if limit is not None and limit < len(view):
+            view = view[:limit]
+        read_nbytes = await _arecv_into(self.sock, view)
+        return view[:read_nbytes]
+
+    async def _next_read(self):
+        if self._remaining == 0:
+            self._finish(True)
+
+        # whatever was read along with the headers comes first
+        if self._already_read:
+            chunk, self._already_read = self._already_read, None
+            if self._remaining is not None:
+                chunk = chunk[:self._remaining]
+                self._remaining -= len(chunk)
+            return chunk
+
+        chunk = await self._recv(self._remaining)
+        if not chunk:
+            # the other side closed the connection
+            # that's only the end of the body if there was no content-length
+            self._finish(False)
+        if self._remaining is not None:
+            self._remaining -= len(chunk)
+        return chunk
+
+    async def _next_chunk(self):
+        decoder = self._decoder
+        if isinstance(self._already_read, bytearray):
+            # what was read along with the headers; slice it without copying
+            self._already_read = memoryview(self._already_read)
+        while True:
+            if decoder.done:
+                self._finish(True)
+            if not self._already_read:
+                self._already_read = await self._recv()
+                if not self._already_read:
+                    self._finish(False)
+
+            consumed, chunk = decoder.feed(self._already_read)
+            self._already_read = self._already_read[consumed:]
+            if chunk:
+                return chunk
+
+
+class ChunkedDecoder:
+    # incremental transfer-encoding: chunked decoder
+    # feed it whatever has been read so far and it hands back chunk data as slices of its input,
+    # so the body is only ever copied once (into wherever the caller puts it)
+    SIZE = 0
+    DATA = 1
+    DATA_END = 2
+    TRAILER = 3
+    DONE = 4
+    MAX_LINE = 1024
 
-            # pop chunk length off already_read and parse it
-            chunk_len_raw, already_read = already_read.split(b'\r\n', 1)
-            chunk_len = int(chunk_len_raw.decode('latin-1'), 16)
-            if chunk_len == 0:
+    def __init__(self):
+        self.state = self.SIZE
+        self._remaining = 0
+        self._line = bytearray()
+
+    @property
+    def done(self):
+        return self.state == self.DONE
+
+    def feed(self, view):
+        # returns (number of bytes of view consumed, chunk data or None)
+        pos = 0
+        end = len(view)
+        while pos < end:
+            state = self.state
+            if state == self.DATA:
+                nbytes = min(self._remaining, end - pos)
+                self._remaining -= nbytes
+                if self._remaining == 0:
+                    self.state = self.DATA_END
+                return pos + nbytes, view[pos:pos + nbytes]
+            elif state == self.DONE:
                 break
 
-            # if the next chunk is partial, read it
-            while len(already_read) < chunk_len + 2:
-                rest_buf = bytearray(chunk_len + 2 - len(already_read))
-                await _aread(rest_buf, already_read, sock)
-                await asyncio.sleep(0)
+            # everything else is line-oriented; collect the line up to LF
+            b = view[pos]
+            pos += 1
+            if b != 0x0a:
+                if len(self._line) >= self.MAX_LINE:
+                    raise ValueError('chunked encoding line too long')
+                self._line.append(b)
+                continue
+            line = self._line.decode('latin-1').strip()
+            self._line = bytearray()
+
+            if state == self.SIZE:
+                # chunk size, possibly followed by ;extensions (which we ignore)
+                self._remaining = int(line.split(';', 1)[0].strip(), 16)
+                self.state = self.DATA if self._remaining else self.TRAILER
+            elif state == self.DATA_END:
+                if line:
+                    raise ValueError('chunk data not followed by CRLF')
+                self.state = self.SIZE
+            elif not line:
+                # an empty line ends the trailer section (trailer fields are ignored)
+                self.state = self.DONE
+
+        return pos, None
 
-            # pop data chunk off already_read and onto body_buf
-            # make sure to consume the CRLF trailer too
-            body_buf += already_read[:chunk_len]
-            already_read = already_read[chunk_len + 2:]
-    else:
-        if status_code == '204':
-            content_length = 0
-        elif 'content-length' in headers:
-            content_length = int(headers['content-length'])
-        else:
-            content_length = None
-        # if content-encoding is not chunked then we (usually) can use content-length
-        # to figure out when we're done reading
-        read_buf = bytearray(1024)
-        if content_length is not None:
-            while len(body_buf) < content_length:
-                await _aread(read_buf, body_buf, sock)
-                await asyncio.sleep(0)
-        else:
-            while (await _aread(read_buf, body_buf, sock)) > 0:
-                await asyncio.sleep(0)
 
-    # done reading body; close the socket
-    sock.close()
+async def _read_body(reader):
+    length = reader.length
+    if length is not None:
+        # the size is known up front: read straight into a buffer of exactly the right size
+        body_buf = bytearray(length)
+        nbytes = await reader.readinto(memoryview(body_buf))
+        if nbytes < length:
+            body_buf = body_buf[:nbytes]
+        return body_buf
 
+    body_buf = bytearray()
+    async for chunk in reader:
+        body_buf += chunk
     return body_buf
 
 
-async def get(url, headers, body=None, timeout=DEFAULT_TIMEOUT):
-    return await asyncio.wait_for(request('GET', url, headers, body=body), timeout)
+async def get(url, headers, body=None, timeout=DEFAULT_TIMEOUT, stream=False, cache=None, priority=PRIORITY_BACKGROUND):
+    return await asyncio.wait_for(request('GET', url, headers, body=body, stream=stream, cache=cache, priority=priority), timeout)
 
 
-async def post(url, headers, body=None, timeout=DEFAULT_TIMEOUT):
-    return await asyncio.wait_for(request('POST', url, headers, body=body), timeout)
+async def post(url, headers, body=None, timeout=DEFAULT_TIMEOUT, stream=False, priority=PRIORITY_BACKGROUND):
+    return await asyncio.wait_for(request('POST', url, headers, body=body, stream=stream, priority=priority), timeout)
@@ -0,0 +1,265 @@
+import asyncio
+import errno
+import time
+from collections import namedtuple
+
+import reactor
+
+
+DEBUG = False
+# requests bigger than these are turned away (431/413) rather than buffered
+# (routes can allow bigger bodies)
+MAX_HEADER_SIZE = 4 * 1024
+MAX_BODY_SIZE = 64 * 1024
+# connections handled at once; further ones wait in the listen backlog
+MAX_CONNECTIONS = 4
+LISTEN_BACKLOG = 4
+# seconds a client gets to send its whole request
+REQUEST_TIMEOUT = 5
+RECV_BUF_SIZE = 1024
+
+STATUS_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    408: 'Request Timeout',
+    411: 'Length Required',
+    412: 'Precondition Failed',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+
+Request = namedtuple('Request', ['verb', 'path', 'params', 'headers', 'body', 'client'])
+
+
+class Response:
+    def __init__(self, body=b'', status_code=200, headers=None):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def encode(self):
+        head = [f'HTTP/1.1 {self.status_code} {STATUS_REASONS.get(self.status_code, "")}']
+        head.extend(f'{name}: {value}' for name, value in self.headers.items())
+        head.append(f'Content-Length: {len(self.body)}')
+        head.append('Connection: close')
+        head.extend(('', ''))
+        raw = bytearray('\r\n'.join(head).encode('utf-8'))
+        raw += self.body
+        return raw
+
+
+class RequestError(Exception):
+    # turned into an error response
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.status_code = status_code
+
+
+def _would_block(e):
+    return e.errno in {errno.EAGAIN, errno.EINPROGRESS, 11}
+
+
+async def _recv_into(sock, view):
+    # returns the number of bytes read, or 0 once the client has closed the connection
+    backoff = None
+    while True:
+        try:
+            return sock.recv_into(view, len(view))
+        except OSError as e:
+            if not _would_block(e):
+                # ENOTCONN/ECONNRESET etc; the client went away
+                return 0
+        if backoff is None:
+            backoff = reactor.Backoff()
+        await reactor.wait_readable(sock, backoff)
+
+
+async def _send_all(sock, data):
+    view = memoryview(data)
+    backoff = None
+    while view:
+        try:
+            sent = sock.send(view)
+        except OSError as e:
+            if not _would_block(e):
+                raise
+            sent = 0
+        if sent:
+            view = view[sent:]
+            continue
+        if backoff is None:
+            backoff = reactor.Backoff()
+        await reactor.wait_writable(sock, backoff)
+
+
+def _parse_head(head):
+    request_line, *header_lines = head.decode('latin-1').split('\r\n')
+    try:
+        verb, target, _ = request_line.split(' ', 2)
+    except ValueError:
+        raise RequestError(400)
+    path, _, query = target.partition('?')
+    params = {}
+    for param in query.split('&'):
+        if param:
+            name, _, value = param.partition('=')
+            params[name] = value
+    headers = {}
+    for header_line in header_lines:
+        name, sep, value = header_line.partition(':')
+        if not sep:
+            raise RequestError(400)
+        headers[name.strip().lower()] = value.strip()
+    return verb.upper(), path, params, headers
+
+
+async def _read_request(sock, client, max_body_size):
+    # max_body_size(verb, path): the biggest body accepted for that request
+    buf = bytearray(RECV_BUF_SIZE)
+    nbytes = 0
+    end = -1
+    while end < 0:
+        if nbytes == len(buf):
+            if nbytes >= MAX_HEADER_SIZE:
+                raise RequestError(431)
+            grown = bytearray(min(2 * len(buf), MAX_HEADER_SIZE))
+            grown[:nbytes] = buf
+            buf = grown
+        read_nbytes = await _recv_into(sock, memoryview(buf)[nbytes:])
+        if not read_nbytes:
+            raise RequestError(400)
+        # only search the new bytes (plus enough of the old ones to catch a split terminator)
+        end = buf.find(b'\r\n\r\n', max(0, nbytes - 3), nbytes + read_nbytes)
+        nbytes += read_nbytes
+
+    verb, path, params, headers = _parse_head(buf[:end])
+
+    if 'transfer-encoding' in headers:
+        # GENA notifications always come with a content-length
+        raise RequestError(411)
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise RequestError(400)
+    if length > max_body_size(verb, path):
+        raise RequestError(413)
+
+    # read the body straight into a buffer of the right size
+    body = bytearray(length)
+    already_read = min(nbytes - end - 4, length)
+    body[:already_read] = buf[end + 4:end + 4 + already_read]
+    del buf
+    view = memoryview(body)
+    pos = already_read
+    while pos < length:
+        read_nbytes = await _recv_into(sock, view[pos:])
+        if not read_nbytes:
+            raise RequestError(400)
+        pos += read_nbytes
+
+    return Request(verb, path, params, headers, body, client)
+
+
+class Server:
+    # minimal asyncio HTTP/1.1 server, enough to receive UPnP event notifications
+    # one request per connection; handlers are coroutines taking a Request and returning a Response
+    def __init__(self, max_connections=MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        # path: {verb: (handler, max body size)}
+        self._routes = {}
+        self._connection_done = asyncio.Event()
+
+    def route(self, path, verb, max_body_size=MAX_BODY_SIZE):
+        def wrapper(handler):
+            self._routes.setdefault(path, {})[verb.upper()] = (handler, max_body_size)
+            return handler
+        return wrapper
+
+    def _max_body_size(self, verb, path):
+        route = self._routes.get(path, {}).get(verb)
+        if route is None:
+            # it's going to be a 404/405 anyway
+            return MAX_BODY_SIZE
+        return route[1]
+
+    async def _dispatch(self, request):
+        handlers = self._routes.get(request.path)
+        if handlers is None:
+            return Response(status_code=404)
+        route = handlers.get(request.verb)
+        if route is None:
+            return Response(status_code=405, headers={'Allow': ', '.join(handlers)})
+        return await route[0](request)
+
+    async def _handle(self, sock, client):
+        start = time.monotonic()
+        response = None
+        try:
+            try:
+                sock.setblocking(False)
+                try:
+                    request = await asyncio.wait_for(_read_request(sock, client, self._max_body_size), REQUEST_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise RequestError(408)
+                self.requests += 1
+                try:
+                    response = await self._dispatch(request)
+                except Exception as e:
+                    print(f'[ahttpd] {request.verb} {request.path} handler raised {type(e).__name__}: {e}')
+                    raise RequestError(500)
+            except RequestError as e:
+                self.errors += 1
+                response = Response(status_code=e.status_code)
+            except OSError as e:
+                self.errors += 1
+                print(f'[ahttpd] connection from {client} failed: {e}')
+
+            try:
+                if response is not None:
+                    await asyncio.wait_for(_send_all(sock, response.encode()), REQUEST_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as e:
+                print(f'[ahttpd] sending response to {client} failed: {type(e).__name__}')
+        except Exception as e:
+            # e.g. MemoryError for the body buffer on a fragmented heap; just drop the connection
+            self.errors += 1
+            print(f'[ahttpd] connection from {client} dropped: {type(e).__name__}: {e}')
+        finally:
+            # whatever happened, the connection slot has to be given back or serve() stops accepting
+            sock.close()
+            self.connections -= 1
+            self._connection_done.set()
+            if DEBUG:
+                status = response.status_code if response is not None else '-'
+                print(f'[ahttpd] {client} {status} in {1000 * (time.monotonic() - start):.1f}ms')
+
+    async def _accept(self, sock, backoff):
+        while True:
+            try:
+                return sock.accept()
+            except OSError as e:
+                if not _would_block(e):
+                    raise
+            await reactor.wait_readable(sock, backoff)
+
+    async def serve(self, sock, address, backlog=LISTEN_BACKLOG):
+        # accept connections on sock until cancelled; each one is handled in its own task
+        sock.bind(address)
+        sock.listen(backlog)
+        sock.setblocking(False)
+        # only used if the socket can't be polled; accepting is otherwise purely readiness driven
+        backoff = reactor.Backoff(initial_ms=10, max_ms=250)
+        loop = asyncio.get_event_loop()
+        while True:
+            while self.connections >= self.max_connections:
+                # leave further connections in the backlog until one finishes
+                self._connection_done.clear()
+                await self._connection_done.wait()
+            conn, client = await self._accept(sock, backoff)
+            self.connections += 1
+            loop.create_task(self._handle(conn, client))
@@ -1,58 +1,473 @@
 import asyncio
-import biplane
+import time
 import wifi
 from socketpool import SocketPool
 
 import ahttp
+import ahttpd
 import babyxml
 import event
+import lru
 
 
-server = biplane.Server()
+server = ahttpd.Server()
+SERVER_PORT = 8000
+# ZoneGroupTopology events carry the whole household's ZoneGroupState, which runs well past
+# ahttpd.MAX_BODY_SIZE in big households; they're sent to their own path that takes more
+ZONE_GROUP_EVENT_PATH = '/zone_group'
+MAX_ZONE_GROUP_EVENT_SIZE = 256 * 1024
 serve_task = None
+renew_task = None
 sonos_client_registry = {}
 sonos_event_registry = {}
 sonos_sid_registry = {}
 sonos_client_sid_registry = {}
+# (ip, service): time.monotonic() the subscription should be renewed at
+sonos_renew_registry = {}
+# set whenever a renewal is (re)scheduled
+renewals_scheduled = asyncio.Event()
+# (sid, service): SEQ of the last event received
+sonos_seq_registry = {}
+# (ip, service) being resynced right now
+resyncs_in_progress = set()
+# SUBSCRIBEs waiting on their response, and an event pulsed whenever one of them finishes
+# (a NOTIFY for an unknown SID could be the first one for the subscription being set up)
+subscribes_in_flight = 0
+subscribes_done = asyncio.Event()
+# service: event counters
+#   events          - NOTIFYs handled
+#   gaps            - times the SEQ skipped ahead
+#   missed          - NOTIFYs those gaps added up to
+#   resyncs         - times the state was queried to make up for them
+#   resync_failures - ...and that failed
+event_stats = {}
+
+# subscription timeout asked for; the player decides what is granted
+SUBSCRIPTION_TIMEOUT = 300
+# seconds to wait on a SUBSCRIBE/UNSUBSCRIBE
+SUBSCRIBE_REQUEST_TIMEOUT = 10
+# subscriptions are renewed once this fraction of the granted timeout has passed
+RENEW_FRACTION = 0.5
+# renewals coming due within this many seconds of each other are sent together
+RENEW_BATCH_WINDOW = 30
+# seconds before a failed renewal is tried again
+RENEW_RETRY_DELAY = 15
+
+# {property: value} for everything in an event
+# most services only have LastChange, which holds an escaped Event document of its own
+EVENT_PROPERTIES = 'e:propertyset/e:property/*'
+# {state variable: value} for everything in a LastChange event
+# (the first element of each name; see channel_values for RenderingControl's per-channel ones)
+LAST_CHANGE_VALUES = 'Event/InstanceID/*@val'
+# GENA event SEQ wraps around to 1 after this
+MAX_SEQ = 0xFFFFFFFF
+# the queries that make up for missed events, per service
+#   (action, arguments, {response field: state variable})
+# only the ones covering state variables that are watched get made
+RESYNC_QUERIES = {
+    'AVTransport': (
+        ('GetTransportInfo', {'InstanceID': 0}, {
+            'CurrentTransportState': 'TransportState',
+            'CurrentTransportStatus': 'TransportStatus',
+            'CurrentSpeed': 'TransportPlaySpeed',
+        }),
+        ('GetPositionInfo', {'InstanceID': 0}, {
+            'Track': 'CurrentTrack',
+            'TrackDuration': 'CurrentTrackDuration',
+            'TrackMetaData': 'CurrentTrackMetaData',
+            'TrackURI': 'CurrentTrackURI',
+        }),
+        ('GetMediaInfo', {'InstanceID': 0}, {
+            'NrTracks': 'NumberOfTracks',
+            'MediaDuration': 'CurrentMediaDuration',
+            'CurrentURI': 'AVTransportURI',
+            'CurrentURIMetaData': 'AVTransportURIMetaData',
+            'NextURI': 'NextAVTransportURI',
+            'NextURIMetaData': 'NextAVTransportURIMetaData',
+            'PlayMedium': 'PlaybackStorageMedium',
+        }),
+    ),
+    'RenderingControl': (
+        ('GetVolume', {'InstanceID': 0, 'Channel': 'Master'}, {'CurrentVolume': 'Volume'}),
+        ('GetMute', {'InstanceID': 0, 'Channel': 'Master'}, {'CurrentMute': 'Mute'}),
+    ),
+    'ZoneGroupTopology': (
+        ('GetZoneGroupAttributes', {}, {
+            'CurrentZoneGroupName': 'ZoneGroupName',
+            'CurrentZoneGroupID': 'ZoneGroupID',
+            'CurrentZonePlayerUUIDsInGroup': 'ZonePlayerUUIDsInGroup',
+            'CurrentMuseHouseholdId': 'MuseHouseholdId',
+        }),
+    ),
+}
+# ZoneGroupTopology evented variable: the GetZoneGroupAttributes field it matches
+ZONE_GROUP_ATTRS = {
+    'ZoneGroupName': 'CurrentZoneGroupName',
+    'ZoneGroupID': 'CurrentZoneGroupID',
+    'ZonePlayerUUIDsInGroup': 'CurrentZonePlayerUUIDsInGroup',
+    'MuseHouseholdId': 'CurrentMuseHouseholdId',
+}
+# path: property for the only ZoneGroupTopology properties kept; the rest (ZoneGroupState above all)
+# are skipped over instead of sitting in LastChange.values for the life of the subscription
+ZONE_GROUP_PROPERTIES = {f'e:propertyset/e:property/{name}': name for name in ZONE_GROUP_ATTRS}
+# the fields used from the first item of DIDL-Lite metadata
+DIDL_ITEM_FIELDS = {
+    'title': 'DIDL-Lite/item/dc:title',
+    'artist': 'DIDL-Lite/item/dc:creator',
+    'album': 'DIDL-Lite/item/upnp:album',
+    'album_art': 'DIDL-Lite/item/upnp:albumArtURI',
+}
+# Sonos re-sends the same track/medium metadata with every LastChange, whatever changed
+DIDL_CACHE_ENTRIES = 8
+# raw DIDL-Lite metadata: didl_item() record; .stats() has the hit/miss counts
+# keyed by the metadata itself so a hash collision (str hashes are only 8-16 bits on the device)
+# can't hand back another track's record
+didl_cache = lru.LRU(DIDL_CACHE_ENTRIES)
+# LastChange deltas kept for watchers that haven't caught up yet
+LAST_CHANGE_HISTORY = 8
 
 
 def htmldecode(text):
-    return (text
-        .replace('&nbsp;', ' ')
-        .replace('&lt;', '<')
-        .replace('&gt;', '>')
-        .replace('&quot;', '"')
-        .replace('&apos;', "'")
-        .replace('&amp;', '&'))
+    # babyxml already decodes entities in everything it parses out of a document;
+    # this is only needed for text that came from somewhere else
+    return babyxml.unescape(text)
+
+
+def didl_item(metadata):
+    # title, artist, album and album_art of the first item in DIDL-Lite metadata
+    # records are shared through didl_cache, so don't modify them
+    item = didl_cache.get(metadata)
+    if item is None:
+        values = babyxml.select(metadata, DIDL_ITEM_FIELDS.values())
+        item = {field: values.get(path, '') for field, path in DIDL_ITEM_FIELDS.items()}
+        didl_cache.put(metadata, item)
+    return item
+
+
+def channel_values(last_change, channel='Master'):
+    # {state variable: value} for a RenderingControl LastChange
+    # Volume, Mute, Loudness etc. come once per channel (Master, LF, RF), in any order and not
+    # necessarily all of them; only the ones for channel (and those without one) are taken
+    instance = babyxml.parse(last_change).get(('Event', 0), {}).get(('InstanceID', 0), {})
+    values = {}
+    for (key, idx), attrs in instance.items():
+        if key.endswith('_attrs') and 'val' in attrs and attrs.get('channel', channel) == channel:
+            values[key[:-len('_attrs')]] = attrs['val']
+    return values
+
+
+class LastChange:
+    # last known value of every LastChange state variable for one subscription
+    # (or of the evented properties used, for services like ZoneGroupTopology that don't use LastChange)
+    # what changed with each NOTIFY is broadcast on .changes for the watchers of those variables
+    def __init__(self):
+        # state variable: value
+        self.values = {}
+        # {state variable: value} of what changed, per NOTIFY
+        self.changes = event.Channel(LAST_CHANGE_HISTORY)
+        # state variables anything has watched (None for all of them)
+        self.watched = set()
+
+    def watch(self, *fields):
+        # watch the given state variables (or all of them)
+        if not fields:
+            self.watched = None
+        elif self.watched is not None:
+            self.watched.update(fields)
+        return LastChangeWatcher(self, fields)
+
+    def update(self, last_change):
+        # returns {state variable: value} of what changed
+        values = self.values
+        changed = {}
+        for field, value in last_change.items():
+            if values.get(field) != value:
+                values[field] = changed[field] = value
+        if changed:
+            self.changes.publish(changed)
+        return changed
+
+
+class LastChangeWatcher:
+    def __init__(self, last_change, fields):
+        self._last_change = last_change
+        self._fields = frozenset(fields) if fields else None
+        self._changes = last_change.changes.subscribe()
+        # the first get() returns whatever is already known
+        self._initial = True
+
+    async def get(self):
+        # waits for and returns {state variable: value} of the watched ones that changed since the last call
+        # changes that piled up in the meantime are merged, with their current values
+        while True:
+            if self._initial:
+                self._initial = False
+                # the values are already current, whatever is pending is included
+                self._changes.skip()
+                fields = self._last_change.values
+            else:
+                missed = self._changes.missed
+                fields = set(await self._changes.get())
+                while self._changes.pending():
+                    fields.update(self._changes.get_nowait())
+                if self._changes.missed != missed:
+                    # fell behind the channel history, so what changed isn't known; assume everything did
+                    fields = self._last_change.values
+            values = self._last_change.values
+            changed = {
+                field: values[field]
+                for field in fields
+                if self._fields is None or field in self._fields
+            }
+            if changed:
+                return changed
 
 
 @server.route('/', 'GET')
-def root(params, headers, body):
-    # return biplane.Response('\n'.join(f'{k}: {v}' for k, v in sonos_client_registry.items()))
-    return biplane.Response(b'OK')
+async def root(request):
+    # return ahttpd.Response('\n'.join(f'{k}: {v}' for k, v in sonos_client_registry.items()))
+    return ahttpd.Response(b'OK')
 
 
-# def event_callback_handler(params, headers, body):
-#     return biplane.Response(b'')
+@server.route(ZONE_GROUP_EVENT_PATH, 'NOTIFY', max_body_size=MAX_ZONE_GROUP_EVENT_SIZE)
 @server.route('/', 'NOTIFY')
-def handle_notify(params, headers, body):
-    sid = headers['sid']
-    service = headers['x-sonos-servicetype']
-    client = sonos_client_sid_registry[sid, service]
+async def handle_notify(request):
+    sid = request.headers.get('sid')
+    service = request.headers.get('x-sonos-servicetype')
+    client = sonos_client_sid_registry.get((sid, service))
+    if client is None:
+        client = await _wait_for_sid(sid, service)
+    if client is None:
+        # not (or no longer) subscribed; tells the player to drop the subscription
+        return ahttpd.Response(status_code=412)
 
     print(f'handling {service} event from {client.ip}:{client.port}')
-    body = babyxml.xmltodict(body.decode('utf-8'))
-    last_change_raw = body['e:propertyset', 0]['e:property', 0]['LastChange', 0]
-    last_change = babyxml.xmltodict(htmldecode(last_change_raw))['Event', 0]['InstanceID', 0]
-    sonos_event_registry[sid, service].set(last_change)
-    return biplane.Response(b'OK')
+    stats = _event_stats(service)
+    stats['events'] += 1
+    missed = _missed_events(sid, service, request.headers.get('seq'))
+    if missed is None:
+        # newer events (or a resync) already superseded it
+        return ahttpd.Response(b'OK')
+
+    if service == 'ZoneGroupTopology':
+        found = babyxml.select(request.body, ZONE_GROUP_PROPERTIES)
+        last_change = {ZONE_GROUP_PROPERTIES[path]: value for path, value in found.items()}
+    else:
+        last_change = babyxml.select(request.body, (EVENT_PROPERTIES,)).get(EVENT_PROPERTIES, {})
+    if service == 'RenderingControl' and 'LastChange' in last_change:
+        last_change = channel_values(last_change['LastChange'])
+    elif 'LastChange' in last_change:
+        last_change = babyxml.select(last_change['LastChange'], (LAST_CHANGE_VALUES,)).get(LAST_CHANGE_VALUES, {})
+    sonos_event_registry[sid, service].update(last_change)
+
+    if missed:
+        # whatever those events changed is still unknown
+        print(f'missed {missed} {service} event(s) from {client.ip}:{client.port}; resyncing')
+        stats['gaps'] += 1
+        stats['missed'] += missed
+        asyncio.get_event_loop().create_task(resync(client, service))
+    return ahttpd.Response(b'OK')
+
+
+async def _wait_for_sid(sid, service):
+    # the player can send the first (SEQ 0) NOTIFY before the SUBSCRIBE response with its SID has been
+    # handled; hold on to NOTIFYs for unknown SIDs while there are SUBSCRIBEs in flight instead of
+    # answering 412, which would make the player drop the subscription it just created
+    # returns the subscribed Sonos, or None if the SID is still unknown
+    deadline = time.monotonic() + SUBSCRIBE_REQUEST_TIMEOUT
+    while subscribes_in_flight:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            await asyncio.wait_for(subscribes_done.wait(), remaining)
+        except asyncio.TimeoutError:
+            break
+        client = sonos_client_sid_registry.get((sid, service))
+        if client is not None:
+            return client
+    return sonos_client_sid_registry.get((sid, service))
+
+
+def _event_stats(service):
+    stats = event_stats.get(service)
+    if stats is None:
+        stats = event_stats[service] = {'events': 0, 'gaps': 0, 'missed': 0, 'resyncs': 0, 'resync_failures': 0}
+    return stats
+
+
+def _missed_events(sid, service, seq):
+    # the number of events skipped between the last one and this one
+    # or None if this one is out of date already
+    try:
+        seq = int(seq)
+    except (TypeError, ValueError):
+        # no usable SEQ; nothing to go on
+        return 0
+    last_seq = sonos_seq_registry.get((sid, service))
+    if last_seq is None:
+        sonos_seq_registry[sid, service] = seq
+        # events start at 0; anything later means the first ones were missed
+        # (e.g. because they came in long before the SUBSCRIBE response, see _wait_for_sid)
+        return seq
+    if seq <= last_seq and last_seq - seq < MAX_SEQ // 2:
+        # a repeat or a straggler (counted as missed already)
+        return None
+    sonos_seq_registry[sid, service] = seq
+    expected = last_seq + 1 if last_seq < MAX_SEQ else 1
+    return (seq - expected) % MAX_SEQ
+
+
+async def resync(client, service):
+    # query the state the missed events would have changed and apply it like an event
+    key = (client.ip, service)
+    if key in resyncs_in_progress:
+        return
+    resyncs_in_progress.add(key)
+    stats = _event_stats(service)
+    try:
+        ev = sonos_event_registry[sonos_sid_registry[key], service]
+        queries = [
+            (action, arguments, fields)
+            for action, arguments, fields in RESYNC_QUERIES.get(service, ())
+            if ev.watched is None or not ev.watched.isdisjoint(fields.values())
+        ]
+        results = await asyncio.gather(*(
+            client._upnp_control(service, action, priority=ahttp.PRIORITY_BACKGROUND, **arguments)
+            for action, arguments, fields in queries
+        ))
+        values = {}
+        for (action, arguments, fields), res in zip(queries, results):
+            if ('s:Fault', 0) in res:
+                raise ValueError(f'{action} returned a fault')
+            for field, variable in fields.items():
+                values[variable] = res.get((field, 0), '')
+        changed = ev.update(values)
+        stats['resyncs'] += 1
+        print(f'resynced {service} from {client.ip}:{client.port} with {len(queries)} queries; {len(changed)} variable(s) had changed')
+    except Exception as e:
+        stats['resync_failures'] += 1
+        print(f'resyncing {service} from {client.ip}:{client.port} failed: {type(e).__name__}({e})')
+    finally:
+        resyncs_in_progress.discard(key)
+
+
+def parse_timeout(timeout):
+    # 'Second-300' -> 300, 'infinite' -> None
+    if timeout is None:
+        return SUBSCRIPTION_TIMEOUT
+    timeout = timeout.strip().lower()
+    if timeout == 'infinite':
+        return None
+    try:
+        return int(timeout.rpartition('-')[2])
+    except ValueError:
+        return SUBSCRIPTION_TIMEOUT
+
+
+def schedule_renewal(ip, service, timeout):
+    granted = parse_timeout(timeout)
+    if granted is None:
+        # never expires
+        sonos_renew_registry.pop((ip, service), None)
+    else:
+        sonos_renew_registry[ip, service] = time.monotonic() + RENEW_FRACTION * granted
+    renewals_scheduled.set()
+
+
+async def _renew(ip, service):
+    client = sonos_client_registry.get((ip, service))
+    if client is None:
+        # unsubscribed in the meantime
+        sonos_renew_registry.pop((ip, service), None)
+        return
+    try:
+        await client.refresh_subscription(service)
+    except Exception as e:
+        # OSError, TimeoutError, SubscriptionError...; the subscription might still be saved by a retry
+        print(f'renewing {service} subscription with {ip} failed: {type(e).__name__}({e})')
+        sonos_renew_registry[ip, service] = time.monotonic() + RENEW_RETRY_DELAY
+
+
+async def renew_subscriptions():
+    # renews every subscription in sonos_renew_registry when it comes due
+    # the ones due soon after are renewed along with it, so there's one wake-up per batch
+    while True:
+        now = time.monotonic()
+        due = [key for key, renew_at in sonos_renew_registry.items() if renew_at <= now]
+        if due:
+            due = [key for key, renew_at in sonos_renew_registry.items() if renew_at <= now + RENEW_BATCH_WINDOW]
+            await asyncio.gather(*(_renew(ip, service) for ip, service in due))
+            continue
+        renewals_scheduled.clear()
+        next_renewal = min(sonos_renew_registry.values(), default=now + 3600)
+        try:
+            await asyncio.wait_for(renewals_scheduled.wait(), next_renewal - now)
+        except asyncio.TimeoutError:
+            pass
 
 
 async def run_server():
     with ahttp.pool.socket() as server_socket:
         server_socket.setsockopt(SocketPool.SOL_SOCKET, SocketPool.SO_REUSEADDR, 1)
-        for _ in server.start(server_socket, ('0.0.0.0', 8000)):
-            await asyncio.sleep(0)
+        await server.serve(server_socket, ('0.0.0.0', SERVER_PORT))
+
+
+def _soap_value(value):
+    # bytes-like arguments are assumed to be ready to send (i.e. already escaped)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return value
+    if isinstance(value, (dict, babyxml.Node)):
+        # XML arguments (e.g. DIDL-Lite metadata) are sent as escaped text
+        value = babyxml.dicttoxml(value)
+    if isinstance(value, str):
+        return babyxml.escape(value).encode('utf-8')
+    return str(value).encode('utf-8')
+
+
+class SubscriptionError(Exception):
+    def __init__(self, service, status_code):
+        super().__init__(f'{service} SUBSCRIBE failed with {status_code}')
+        self.service = service
+        self.status_code = status_code
+
+
+class SoapTemplate:
+    # precompiled SOAP request for one (service, action, argument names)
+    # the envelope is encoded once, calls only splice in the escaped argument values
+    def __init__(self, url, schema, action, argument_names):
+        self.url = url
+        self.headers = {
+            'Content-Type': 'text/xml; charset="utf-8"',
+            'SOAPACTION': f'{schema}#{action}',
+        }
+        head = ''.join([
+            '<?xml version="1.0"?>',
+            '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"',
+            ' s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">',
+            '<s:Body>',
+           f'<u:{action} xmlns:u="{schema}">',
+        ])
+        # the envelope split up around each argument value
+        self._pieces = []
+        for name in argument_names:
+            self._pieces.append(f'{head}<{name}>'.encode('utf-8'))
+            head = f'</{name}>'
+        self._pieces.append(f'{head}</u:{action}></s:Body></s:Envelope>'.encode('utf-8'))
+        self._size = sum(len(piece) for piece in self._pieces)
+
+    def render(self, values):
+        values = [_soap_value(value) for value in values]
+        body = bytearray(self._size + sum(len(value) for value in values))
+        view = memoryview(body)
+        pos = 0
+        for piece, value in zip(self._pieces, values):
+            view[pos:pos + len(piece)] = piece
+            pos += len(piece)
+            view[pos:pos + len(value)] = value
+            pos += len(value)
+        view[pos:] = self._pieces[-1]
+        return body
 
 
 class Sonos:
@@ -94,6 +509,7 @@ class Sonos:
         self._service_urls = {}
         self._service_schemas = {}
         self._service_event_urls = {}
+        self._soap_templates = {}
 
     @classmethod
     async def connect(cls, ip, port=1400, household_id=None, **kwargs):
@@ -114,51 +530,88 @@ class Sonos:
         if sonos_client_registry.get(self.ip) is self:
             del sonos_client_registry[self.ip]
 
-    async def subscribe(self, service):
-        global serve_task
+    async def _subscription_request(self, service, headers):
+        url = f'{self.base}{self._service_event_urls[service]}'
+        resp = await asyncio.wait_for(
+            ahttp.request('SUBSCRIBE', url, headers, priority=ahttp.PRIORITY_EVENTS),
+            SUBSCRIBE_REQUEST_TIMEOUT,
+        )
+        if resp.status_code != 200:
+            raise SubscriptionError(service, resp.status_code)
+        schedule_renewal(self.ip, service, resp.headers.get('timeout'))
+        return resp
+
+    async def subscribe(self, service, ev=None):
+        # ev: the LastChange to carry on with when resubscribing
+        global serve_task, renew_task, subscribes_in_flight
+        loop = asyncio.get_event_loop()
         if serve_task is None:
-            serve_task = asyncio.get_event_loop().create_task(run_server())
+            serve_task = loop.create_task(run_server())
+        if renew_task is None:
+            renew_task = loop.create_task(renew_subscriptions())
 
         sonos_client_registry[self.ip, service] = self
-        url = f'{self.base}{self._service_event_urls[service]}'
+        path = ZONE_GROUP_EVENT_PATH if service == 'ZoneGroupTopology' else '/'
         headers = {
-            'callback': f'<http://{wifi.radio.ipv4_address}:8000/>',
+            'callback': f'<http://{wifi.radio.ipv4_address}:{SERVER_PORT}{path}>',
             'NT': 'upnp:event',
-            'Timeout': 'Second-300',
+            'Timeout': f'Second-{SUBSCRIPTION_TIMEOUT}',
         }
-        resp = await ahttp.request('SUBSCRIBE', url, headers)
-        sonos_sid_registry[self.ip, service] = resp.headers['sid']
-        sonos_client_sid_registry[resp.headers['sid'], service] = self
-        sonos_event_registry[resp.headers['sid'], service] = ev = event.EventWithData()
+        if ev is None:
+            ev = LastChange()
+        subscribes_in_flight += 1
+        try:
+            resp = await self._subscription_request(service, headers)
+            sonos_sid_registry[self.ip, service] = resp.headers['sid']
+            sonos_client_sid_registry[resp.headers['sid'], service] = self
+            sonos_event_registry[resp.headers['sid'], service] = ev
+        finally:
+            subscribes_in_flight -= 1
+            # wake the NOTIFYs waiting in _wait_for_sid to look again
+            subscribes_done.set()
+            subscribes_done.clear()
         print(f'subscribed to events with sid={resp.headers["sid"]}')
         return ev
 
     async def unsubscribe(self, service):
         sid = sonos_sid_registry.pop((self.ip, service))
         del sonos_client_registry[self.ip, service]
+        sonos_renew_registry.pop((self.ip, service), None)
         del sonos_client_sid_registry[sid, service]
         del sonos_event_registry[sid, service]
+        sonos_seq_registry.pop((sid, service), None)
         headers = {
             'SID': sid,
         }
         url = f'{self.base}{self._service_event_urls[service]}'
-        await ahttp.request('UNSUBSCRIBE', url, headers)
+        await ahttp.request('UNSUBSCRIBE', url, headers, priority=ahttp.PRIORITY_EVENTS)
         print(f'unsubscribed from events with sid={sid}')
 
     async def refresh_subscription(self, service):
         sid = sonos_sid_registry[self.ip, service]
-        url = f'{self.base}{self._service_event_urls[service]}'
         headers = {
             'SID': sid,
-            'Timeout': 'Second-300',
+            'Timeout': f'Second-{SUBSCRIPTION_TIMEOUT}',
         }
-        await ahttp.request('SUBSCRIBE', url, headers)
-        print(f'refreshed subscription with sid={sid}')
+        try:
+            await self._subscription_request(service, headers)
+        except SubscriptionError as e:
+            if e.status_code != 412:
+                raise
+            # the player doesn't know the sid anymore (expired, or the player restarted);
+            # subscribe again and move the existing watchers over to the new sid
+            print(f'subscription with sid={sid} is gone; resubscribing')
+            await self.subscribe(service, sonos_event_registry[sid, service])
+            del sonos_client_sid_registry[sid, service]
+            del sonos_event_registry[sid, service]
+            sonos_seq_registry.pop((sid, service), None)
+        else:
+            print(f'refreshed subscription with sid={sid}')
 
     @classmethod
     async def get_device_info(cls, ip, port):
         url = f'http://{ip}:{port}/xml/device_description.xml'
-        resp = await ahttp.get(url, {}, None)
+        resp = await ahttp.get(url, {}, None, cache=ahttp.cache)
         return resp.xml()['root', 0]
 
     async def map_services(self):
@@ -190,29 +643,35 @@ class Sonos:
         # guaranteed to exist
         if not self._household_id:
             self._household_id = attrs['CurrentMuseHouseholdId', 0]
-        self._zone_attrs.update(attrs)
-
-    async def _upnp_control(self, service, action, **arguments):
-        soap_headers = {
-            'Content-Type': 'text/xml; charset="utf-8"',
-            "SOAPACTION": f'{self._service_schemas[service]}#{action}',
-        }
-        wrapped_arguments = babyxml.dicttoxml(arguments)
-        soap_body = ''.join([
-            '<?xml version="1.0"?>',
-            '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"',
-            ' s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">',
-            '<s:Body>',
-           f'<u:{action} xmlns:u="{self._service_schemas[service]}">',
-           f'{wrapped_arguments}',
-           f'</u:{action}>',
-            '</s:Body>',
-            '</s:Envelope>'
-        ])
+        # attrs is a babyxml.Node; dict.update() on CircuitPython would iterate it as (key, value) pairs
+        for key, value in attrs.items():
+            self._zone_attrs[key] = value
+
+    def update_zone_attrs(self, changed):
+        # apply ZoneGroupTopology event values
+        for field, attr in ZONE_GROUP_ATTRS.items():
+            if field in changed:
+                self._zone_attrs[attr, 0] = changed[field]
+
+    def _soap_template(self, service, action, argument_names):
+        key = (service, action, argument_names)
+        template = self._soap_templates.get(key)
+        if template is None:
+            template = self._soap_templates[key] = SoapTemplate(
+                f'http://{self.ip}:1400{self._service_urls[service]}',
+                self._service_schemas[service],
+                action,
+                argument_names,
+            )
+        return template
+
+    async def _upnp_control(self, service, action, priority=ahttp.PRIORITY_INTERACTIVE, **arguments):
+        template = self._soap_template(service, action, tuple(arguments))
         resp = await ahttp.post(
-            f'http://{self.ip}:1400{self._service_urls[service]}',
-            headers=soap_headers,
-            body=soap_body
+            template.url,
+            headers=dict(template.headers),
+            body=template.render(arguments.values()),
+            priority=priority,
         )
         envelope_body = resp.xml()['s:Envelope', 0]['s:Body', 0]
         if envelope_response := envelope_body.get((f'u:{action}Response', 0)):
@@ -220,7 +679,7 @@ class Sonos:
         return envelope_body
 
     async def get_zone_group_attributes(self):
-        res = await self._upnp_control('ZoneGroupTopology', 'GetZoneGroupAttributes')
+        res = await self._upnp_control('ZoneGroupTopology', 'GetZoneGroupAttributes', priority=ahttp.PRIORITY_BACKGROUND)
         if res:
             return res
         return None
@@ -257,18 +716,17 @@ class Sonos:
         res = await self._upnp_control('AVTransport', 'GetPositionInfo', Channel='Master', InstanceID=0)
         if not res or ('TrackMetaData', 0) not in res:
             return None
-        trackmetaxml = htmldecode(res['TrackMetaData', 0])
-        if trackmetaxml == 'NOT_IMPLEMENTED':
+        if res['TrackMetaData', 0] == 'NOT_IMPLEMENTED':
             return None
-        trackmeta = babyxml.xmltodict(trackmetaxml)['DIDL-Lite', 0]['item', 0]
-        album_art_uri = htmldecode(trackmeta.get(('upnp:albumArtURI', 0), ''))
+        trackmeta = didl_item(res['TrackMetaData', 0])
+        album_art_uri = trackmeta['album_art']
         if album_art_uri and '://' not in album_art_uri:
             album_art_uri = ''.join([self.base, album_art_uri])
 
         return {
-            'title': htmldecode(trackmeta.get(('dc:title', 0), '')),
-            'artist': htmldecode(trackmeta.get(('dc:creator', 0), '')),
-            'album': htmldecode(trackmeta.get(('upnp:album', 0), '')),
+            'title': trackmeta['title'],
+            'artist': trackmeta['artist'],
+            'album': trackmeta['album'],
             'album_art': album_art_uri,
             'position': res['RelTime', 0],
             'duration': res['TrackDuration', 0],
@@ -277,25 +735,23 @@ class Sonos:
 
     async def medium_info(self):
         res = await self._upnp_control('AVTransport', 'GetMediaInfo', InstanceID=0)
-        urimetaxml = htmldecode(res.get(('CurrentURIMetaData', 0), ''))
-        if urimetaxml:
-            urimeta = babyxml.xmltodict(urimetaxml)['DIDL-Lite', 0]['item', 0]
-        else:
-            urimeta = {}
+        urimeta = didl_item(res.get(('CurrentURIMetaData', 0), ''))
 
         return {
-            'title': htmldecode(urimeta.get(('dc:title', 0), '')),
-            'medium_art': htmldecode(urimeta.get(('upnp:albumArtURI', 0), '')),
+            'title': urimeta['title'],
+            'medium_art': urimeta['album_art'],
             'medium': res.get(('PlayMedium', 0), ''),
         }
 
     async def queue_slice(self, count=5, offset=0):
-        res = await self._upnp_control('Queue', 'Browse', QueueID=0, StartingIndex=offset, RequestedCount=count)
+        res = await self._upnp_control(
+            'Queue', 'Browse', priority=ahttp.PRIORITY_BACKGROUND,
+            QueueID=0, StartingIndex=offset, RequestedCount=count,
+        )
         if not res:
             return None
 
-        resultxml = htmldecode(res['Result', 0])
-        result = babyxml.xmltodict(resultxml)['DIDL-Lite', 0]
+        result = babyxml.parse(res['Result', 0])['DIDL-Lite', 0]
         item_gen = (
             ((key, idx), item)
             for (key, idx), item in result.items()
@@ -304,13 +760,13 @@ class Sonos:
 
         queue = []
         for (key, idx), item in item_gen:
-            album_art_uri =  htmldecode(item['upnp:albumArtURI', 0])
+            album_art_uri = item['upnp:albumArtURI', 0]
             if album_art_uri and '://' not in album_art_uri:
                 album_art_uri = ''.join((self.base, album_art_uri))
             queue.append({
-                'title': htmldecode(item.get(('dc:title', 0), '')),
-                'artist': htmldecode(item.get(('dc:creator', 0), '')),
-                'album': htmldecode(item.get(('upnp:album', 0), '')),
+                'title': item.get(('dc:title', 0), ''),
+                'artist': item.get(('dc:creator', 0), ''),
+                'album': item.get(('upnp:album', 0), ''),
                 'album_art': album_art_uri,
                 'duration': item['res_attrs', 0]['duration'],
                 'queue_position': offset + idx,
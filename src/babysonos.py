@@ -229,14 +229,14 @@ class Sonos:
         res = self._upnp_control('AVTransport', 'GetPositionInfo', Channel='Master')
         if not res:
             return None
-        trackmetaxml = res['TrackMetaData', 0].replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"').replace('&amp;', '&')
+        trackmetaxml = res['TrackMetaData', 0]
         trackmeta = babyxml.xmltodict(trackmetaxml)['DIDL-Lite', 0]
 
         return {
-            'title': trackmeta['item', 0]['dc:title', 0].replace('&apos;', "'").replace('&amp;', '&'),
+            'title': trackmeta['item', 0]['dc:title', 0],
             'artist': trackmeta['item', 0]['dc:creator', 0],
             'album': trackmeta['item', 0]['upnp:album', 0],
-            'album_art': ''.join([self.base, trackmeta['item', 0]['upnp:albumArtURI', 0].replace('&amp;', '&')]),
+            'album_art': ''.join([self.base, trackmeta['item', 0]['upnp:albumArtURI', 0]]),
             'position': res['RelTime', 0],
             'duration': res['TrackDuration', 0],
         }
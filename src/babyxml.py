@@ -1,19 +1,138 @@
-def _tokenator(xml):
-    collected = []
-    for ch in xml:
-        if ch == '<':
-            if collected:
-                yield ''.join(collected)
-                collected.clear()
-        elif ch in {'\r', '\n'}:
+# the delimiters the tokenizer and select need, for str and for bytes-like documents
+# (lt, gt, newline and carriage return to test for with in, newline, carriage return, empty,
+#  end tag, processing instruction, declaration, self-closing)
+# testing bytes for an int is much cheaper than testing for a bytes
+_STR_SYNTAX = ('<', '>', '\n', '\r', '\n', '\r', '', '</', '<?', '<!', '/>')
+_BYTES_SYNTAX = (b'<', b'>', 10, 13, b'\n', b'\r', b'', b'</', b'<?', b'<!', b'/>')
+
+
+def _same(token):
+    return token
+
+
+def _utf8(token):
+    return str(token, 'utf-8')
+
+
+def _source(xml):
+    # returns (xml, syntax, decode) for a str, bytes, bytearray or memoryview document
+    # bytes-like documents are parsed as they are; only the tokens that get used are decoded
+    # (memoryview has no find, so that gets copied once)
+    if isinstance(xml, str):
+        return xml, _STR_SYNTAX, _same
+    if isinstance(xml, memoryview):
+        xml = bytes(xml)
+    return xml, _BYTES_SYNTAX, _utf8
+
+
+def _strip_newlines(token, syntax):
+    if syntax[2] in token:
+        token = token.replace(syntax[4], syntax[6])
+    if syntax[3] in token:
+        token = token.replace(syntax[5], syntax[6])
+    return token
+
+
+def _tokenator(xml, syntax=_STR_SYNTAX):
+    # yields the text between tags and the tags themselves (including the <>)
+    # by slicing between delimiters found with find rather than walking every character
+    # tokens are the same type as xml
+    lt, gt = syntax[:2]
+    find = xml.find
+    pos = 0
+    while True:
+        start = find(lt, pos)
+        if start < 0:
+            # anything after the last tag isn't part of the document
+            return
+        if start > pos:
+            text = _strip_newlines(xml[pos:start], syntax)
+            if text:
+                yield text
+        end = find(gt, start)
+        if end < 0:
+            # unterminated tag
+            return
+        yield _strip_newlines(xml[start:end + 1], syntax)
+        pos = end + 1
+
+
+# named entities unescape knows about; &nbsp; becomes a plain space since the fonts don't have U+00A0
+# &amp; has to be last so decoding it can't create another entity
+_ENTITIES = (
+    ('&lt;', '<'),
+    ('&gt;', '>'),
+    ('&quot;', '"'),
+    ('&apos;', "'"),
+    ('&nbsp;', ' '),
+    ('&amp;', '&'),
+)
+_ENTITY_CHARS = {entity[1:-1]: char for entity, char in _ENTITIES}
+# longest reference _unescape_refs will look for a ; in: &#x10ffff;
+_MAX_REF = 10
+
+
+def _unescape_refs(text):
+    # walk the references one at a time; needed once numeric references are involved
+    # since neither order of replace passes decodes all of &#38;amp; and &amp;#38; correctly
+    parts = []
+    pos = 0
+    amp = text.find('&')
+    while amp >= 0:
+        semi = text.find(';', amp + 1, amp + _MAX_REF)
+        if semi < 0:
+            amp = text.find('&', amp + 1)
             continue
-        elif ch == '>':
-            collected.append(ch)
-            yield ''.join(collected)
-            collected.clear()
+        ref = text[amp + 1:semi]
+        if ref[:1] == '#':
+            try:
+                if ref[1:2] in ('x', 'X'):
+                    char = chr(int(ref[2:], 16))
+                else:
+                    char = chr(int(ref[1:]))
+            except ValueError:
+                char = None
+        else:
+            char = _ENTITY_CHARS.get(ref)
+        if char is None:
+            amp = text.find('&', amp + 1)
             continue
+        parts.append(text[pos:amp])
+        parts.append(char)
+        pos = semi + 1
+        amp = text.find('&', pos)
+    parts.append(text[pos:])
+    return ''.join(parts)
+
 
-        collected.append(ch)
+def unescape(text):
+    # decode named and numeric (&#39; &#x27;) character references, one level deep
+    # anything that isn't a reference we know is left as-is
+    if '&' not in text:
+        return text
+    if '&#' in text:
+        return _unescape_refs(text)
+    # only named entities; a replace per entity that's actually present is far cheaper
+    # than walking the references in python
+    for entity, char in _ENTITIES:
+        if entity in text:
+            text = text.replace(entity, char)
+    return text
+
+
+def escape(text):
+    # escape text for use in element content or (quoted) attribute values
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    if '"' in text:
+        text = text.replace('"', '&quot;')
+    if "'" in text:
+        text = text.replace("'", '&apos;')
+    return text
 
 
 def safe_dict_insert(d, keypath, value):
@@ -49,53 +168,426 @@ def parse_attrs(attrs_raw):
         qc = rest[0]
         value_end = rest.index(qc, 1)
         value, attrs_raw = rest[1:value_end], rest[value_end + 2:]
-        attrs[name] = value
+        attrs[name] = unescape(value)
     return attrs
 
 
-# NOTE: this is working well overall, but there are a few things left to potentially address
-# TODO: the way this function currently builds the dict is inefficient
+class _Element:
+    # an open element while building the document
+    # node stays None until the element gets some content; elements that never do are left out
+    # of the document entirely and don't take up a sibling index
+    __slots__ = ('parent', 'name', 'idx', 'node', 'counts')
+
+    def __init__(self, parent, name, idx, node=None):
+        self.parent = parent
+        self.name = name
+        self.idx = idx
+        self.node = node
+        # child name: number of those children in node so far
+        self.counts = {}
+
+    def materialize(self):
+        if self.node is None:
+            parent = self.parent
+            parent.materialize()[self.name, self.idx] = self.node = {}
+            parent.counts[self.name] = self.idx + 1
+        return self.node
+
+
 def _nest(tokens):
     doc = {}
-    path = []
+    cur = _Element(None, None, None, doc)
     for token in tokens:
         token = token.strip()
         if not token:
             continue
         if token.startswith('<?xml'):
             continue
-        if token.startswith('<') and not token.startswith('</'):
-            tag_body = token[1:-1].split(' ', 1)
+        if token.startswith('</'):
+            if cur.parent is not None:
+                cur = cur.parent
+        elif token.startswith('<'):
+            self_closing = token.endswith('/>')
+            # the / of a self-closing tag belongs to neither the name nor the attributes
+            tag_body = token[1:-2 if self_closing else -1].rstrip().split(' ', 1)
             name = tag_body[0]
-            idx = sum(1 for k in get_deep_key(doc, path) if k[0] == name)
+            idx = cur.counts.get(name, 0)
 
             if len(tag_body) == 2:
-                attrs = parse_attrs(tag_body[1])
-                attrs_path = path.copy()
-                attrs_path.append((f'{name}_attrs', idx))
-                safe_dict_insert(doc, attrs_path, attrs)
+                cur.materialize()[f'{name}_attrs', idx] = parse_attrs(tag_body[1])
 
-            if token.endswith('/>'):
-                safe_dict_insert(doc, path + [(name, idx)], {})
+            if self_closing:
+                cur.materialize()[name, idx] = {}
+                cur.counts[name] = idx + 1
             else:
-                path.append((name, idx))
-
-        elif token.startswith('</'):
-            path.pop()
-            if path and isinstance(path[-1], int):
-                path.pop()
-        else:
-            safe_dict_insert(doc, path, token)
+                cur = _Element(cur, name, idx)
+        elif cur.parent is not None:
+            # text content replaces whatever the element held so far
+            cur.parent.materialize()[cur.name, cur.idx] = unescape(token)
+            cur.parent.counts[cur.name] = cur.idx + 1
 
     return doc
 
 
 def xmltodict(xmlraw):
-    return _nest(_tokenator(xmlraw))
+    xmlraw, syntax, decode = _source(xmlraw)
+    tokens = _tokenator(xmlraw, syntax)
+    if decode is not _same:
+        tokens = map(decode, tokens)
+    return _nest(tokens)
+
+
+class Node:
+    # compact alternative to the nested dicts xmltodict builds
+    # children live in one flat list of [name, value, attrs, ...] triples instead of a dict keyed by
+    # (name, idx) tuples with an extra (name_attrs, idx) entry; value is the element's text, a Node,
+    # or None for an element with attributes but no content
+    # it's looked up the same way the dicts are: node['item', 0], node['res_attrs', 0], .get, .items
+    __slots__ = ('_children',)
+
+    def __init__(self, children=None):
+        self._children = [] if children is None else children
+
+    def _find(self, name, idx):
+        # position in _children of the idx-th child called name, or -1
+        # children with attributes but no content don't count; like in xmltodict they get no index of their own
+        children = self._children
+        for i in range(0, len(children), 3):
+            if children[i] == name and children[i + 1] is not None:
+                if not idx:
+                    return i
+                idx -= 1
+        return -1
+
+    def _attrs(self, name, idx):
+        # what xmltodict ends up with under (name_attrs, idx): the attributes of the idx-th child called
+        # name, or else those of the last attribute-only one in front of it (which shares its index)
+        children = self._children
+        attrs = None
+        for i in range(0, len(children), 3):
+            if children[i] == name:
+                if children[i + 2] is not None:
+                    attrs = children[i + 2]
+                if children[i + 1] is not None:
+                    if not idx:
+                        return attrs
+                    idx -= 1
+                    attrs = None
+        # attribute-only children after the last one with content
+        return attrs if not idx else None
+
+    def __getitem__(self, key):
+        name, idx = key
+        children = self._children
+        i = self._find(name, idx)
+        if i >= 0:
+            return children[i + 1]
+        if name.endswith('_attrs'):
+            attrs = self._attrs(name[:-6], idx)
+            if attrs is not None:
+                return attrs
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def items(self):
+        children = self._children
+        counts = {}
+        # name: attributes of attribute-only children, waiting for the next child with that name
+        pending = {}
+        for i in range(0, len(children), 3):
+            name, value, attrs = children[i:i + 3]
+            if value is None:
+                pending[name] = attrs
+                continue
+            idx = counts.get(name, 0)
+            counts[name] = idx + 1
+            if attrs is None:
+                attrs = pending.pop(name, None)
+            else:
+                pending.pop(name, None)
+            if attrs is not None:
+                yield (f'{name}_attrs', idx), attrs
+            yield (name, idx), value
+        for name, attrs in pending.items():
+            yield (f'{name}_attrs', counts.get(name, 0)), attrs
+
+    def keys(self):
+        for key, _ in self.items():
+            yield key
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return sum(1 for _ in self.items())
+
+    def to_dict(self):
+        # the same document as xmltodict would have built
+        return {key: value.to_dict() if isinstance(value, Node) else value for key, value in self.items()}
+
+
+# shared by every self-closing element without content; Nodes are never modified after parsing
+_EMPTY = Node()
+
+
+def _build(tokens):
+    # like _nest, but builds Nodes
+    root = Node()
+    # [node or None until it has children, parent's children, position of its triple in them]
+    # for each open element
+    stack = [[root, None, None]]
+    for token in tokens:
+        token = token.strip()
+        if not token:
+            continue
+        if token.startswith('<?xml'):
+            continue
+        frame = stack[-1]
+        if token.startswith('</'):
+            if len(stack) > 1:
+                stack.pop()
+                node, children, pos = frame
+                if node is not None and not node._children:
+                    # all of its children were left out
+                    children[pos + 1] = None
+                if children[pos + 1] is None and children[pos + 2] is None:
+                    # never got any content or attributes; leave it out
+                    del children[pos:pos + 3]
+        elif token.startswith('<'):
+            self_closing = token.endswith('/>')
+            tag_body = token[1:-2 if self_closing else -1].rstrip().split(' ', 1)
+            name = tag_body[0]
+            attrs = parse_attrs(tag_body[1]) if len(tag_body) == 2 else None
+            node = frame[0]
+            if node is None:
+                # the first child of this element
+                node = frame[0] = frame[1][frame[2] + 1] = Node()
+            children = node._children
+            if self_closing:
+                children.extend((name, _EMPTY, attrs))
+            else:
+                children.extend((name, None, attrs))
+                stack.append([None, children, len(children) - 3])
+        elif len(stack) > 1:
+            # text content replaces whatever the element held so far
+            frame[0] = None
+            frame[1][frame[2] + 1] = unescape(token)
+
+    return root
+
+
+def parse(xmlraw):
+    # xmltodict, but the document is made of compact Nodes
+    xmlraw, syntax, decode = _source(xmlraw)
+    tokens = _tokenator(xmlraw, syntax)
+    if decode is not _same:
+        tokens = map(decode, tokens)
+    return _build(tokens)
+
+
+def _compile_path(path):
+    # 'a/b/*@attr' -> (('a', 'b', '*'), 'attr')
+    elements, _, attr = path.partition('@')
+    return tuple(elements.split('/')), attr or None
+
+
+def _attr_value(attrs_raw, attr):
+    # the value of one attribute, found without copying or collecting the others
+    pos = 0
+    while True:
+        eq = attrs_raw.find('=', pos)
+        if eq < 0:
+            return None
+        quote = attrs_raw[eq + 1]
+        end = attrs_raw.find(quote, eq + 2)
+        if end < 0:
+            return None
+        if attrs_raw[pos:eq].strip() == attr:
+            return attrs_raw[eq + 2:end]
+        pos = end + 1
+
+
+def select(xml, paths):
+    # pull just the values at paths out of xml without building the whole document
+    # paths are element names separated by / and match from the document root
+    #   'a/b/c'     -> text of the first a/b/c element
+    #   'a/b/c@x'   -> attribute x of the first a/b/c element that has one
+    #   a * matches any one element; paths containing one give a dict of
+    #   {element name: value} with the first element of each name instead
+    # subtrees none of the paths lead into are skipped over without parsing them
+    # xml can be str or bytes-like; only the tags it looks at and the values it returns get decoded
+    # returns {path: value} for each path that matched anything, with entities decoded
+    xml, syntax, decode = _source(xml)
+    end_tag, instruction, declaration, self_closing_end = syntax[7:]
+    lt = syntax[0]
+    selectors = []
+    for path in set(paths):
+        segments, attr = _compile_path(path)
+        selectors.append((path, segments, attr, '*' in segments))
+    wildcard = any(s[3] for s in selectors)
+    results = {}
+    # the selectors that match all of the open elements so far, one list per open element
+    live = [selectors]
+    # (dict, key) pairs waiting for the text of the element that was just opened
+    capture = []
+    # depth of the subtree being skipped
+    skip = 0
+    for token in _tokenator(xml, syntax):
+        if not token.startswith(lt):
+            if capture and not skip:
+                text = unescape(decode(token).strip())
+                for found, key in capture:
+                    found[key] = text
+                capture = []
+            continue
+        if token.startswith(instruction) or token.startswith(declaration):
+            continue
+
+        if token.startswith(end_tag):
+            if skip:
+                skip -= 1
+                continue
+            live.pop()
+            capture = []
+        else:
+            self_closing = token.endswith(self_closing_end)
+            if skip:
+                if not self_closing:
+                    skip += 1
+                continue
+
+            token = decode(token)
+            name, _, attrs_raw = token[1:-2 if self_closing else -1].partition(' ')
+            depth = len(live)
+            matching = []
+            capture = []
+            for selector in live[-1]:
+                path, segments, attr, has_wildcard = selector
+                segment = segments[depth - 1]
+                if segment != name and segment != '*':
+                    continue
+                if len(segments) > depth:
+                    matching.append(selector)
+                    continue
+
+                if has_wildcard:
+                    found, key = results.setdefault(path, {}), name
+                else:
+                    found, key = results, path
+                if key in found:
+                    # only the first match counts
+                    continue
+                if attr is None:
+                    found[key] = ''
+                    capture.append((found, key))
+                    continue
+                value = _attr_value(attrs_raw, attr)
+                if value is not None:
+                    found[key] = unescape(value)
+
+            if self_closing:
+                capture = []
+            elif matching or capture:
+                live.append(matching)
+            else:
+                skip = 1
+
+        if not wildcard and not capture and len(results) == len(selectors):
+            # everything has been found
+            break
+
+    return results
+
+
+def _write_elements(d, write):
+    for key, value in d.items():
+        if isinstance(key, tuple):
+            # (name, idx) keys like xmltodict builds
+            name, idx = key
+            attrs_key = (f'{name}_attrs', idx)
+            element_key = (name[:-6], idx)
+        else:
+            name = key
+            attrs_key = f'{name}_attrs'
+            element_key = name[:-6]
+        if name.endswith('_attrs'):
+            if element_key not in d:
+                # attributes of an element without content; written as <name ...></name> since that's
+                # what reads back as one (<name .../> would be an empty element with attributes)
+                _write_element(name[:-6], value, '', write)
+            continue
+
+        attrs = d.get(attrs_key)
+        if isinstance(value, list):
+            for i, item in enumerate(value):
+                _write_element(name, attrs[i] if isinstance(attrs, list) else attrs, item, write)
+        else:
+            _write_element(name, attrs, value, write)
+
+
+def _write_element(name, attrs, value, write):
+    write('<')
+    write(name)
+    if attrs:
+        for attr, attr_value in attrs.items():
+            write(f' {attr}="')
+            write(escape(str(attr_value)))
+            write('"')
+    if value is None or (isinstance(value, (dict, Node)) and not value):
+        write('/>')
+        return
+    write('>')
+    if isinstance(value, (dict, Node)):
+        _write_elements(value, write)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        # assumed to be ready to go (i.e. already escaped)
+        write(value)
+    else:
+        write(escape(value if isinstance(value, str) else str(value)))
+    write('</')
+    write(name)
+    write('>')
+
+
+def dicttoxml(d, out=None):
+    # serialize {name: value} as XML elements, escaping text and attribute values
+    #   value can be text (or anything str() works on), a dict of child elements, None or {} for
+    #   an empty element, bytes that are already escaped, or a list of those for repeated elements
+    #   'name_attrs': {attr: value} (or a list of them for repeated elements) gives name attributes
+    #   documents from xmltodict or parse, with their (name, idx) keys, work too
+    # with out=None the XML is returned as a str
+    # otherwise it's encoded as utf-8 and appended to out, a bytearray, or written to out, a stream
+    if out is None:
+        parts = []
+
+        def write(chunk):
+            parts.append(chunk if isinstance(chunk, str) else str(chunk, 'utf-8'))
+
+        _write_elements(d, write)
+        return ''.join(parts)
 
+    if isinstance(out, bytearray):
+        def write(chunk):
+            out.extend(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    else:
+        def write(chunk):
+            out.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
 
-def dicttoxml(d):
-    return ''.join(
-        f'<{k}>{dicttoxml(v) if isinstance(v, dict) else v}</{k}>'
-        for k, v in d.items()
-    )
+    _write_elements(d, write)
+    return out
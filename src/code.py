@@ -1,7 +1,5 @@
 import asyncio
-import babyxml
 import collections
-import io
 import json
 import os
 import traceback
@@ -16,7 +14,7 @@ import controls
 import event
 import ntp
 import ui
-from asonos import htmldecode
+from asonos import didl_item
 from playermanager import PlayerManager
 
 
@@ -111,8 +109,10 @@ async def main():
     print('setting up controls')
     ano = await controls.AnoRotary.new(ui.i2c)
     qbtns = await controls.QualiaButtons.new(ui.i2c)
-    album_art_changed = event.EventWithData()
+    # album art uri; only the latest one matters
+    album_art_changed = event.Channel(history=1)
     cur_state = None
+    cur_volume = None
     player_manager = PlayerManager()
     player_manager.init_storage()
 
@@ -136,7 +136,13 @@ async def main():
     async def _avtransport():
         nonlocal cur_state
         await player_manager.connected.wait()
-        ev = player_manager.callback_events['AVTransport']
+        # only woken up for the state variables used here, and told which of them changed
+        changes = player_manager.callback_events['AVTransport'].watch(
+            'TransportState',
+            'CurrentTrackDuration',
+            'CurrentTrackMetaData',
+            'AVTransportURIMetaData',
+        )
 
         last_album_art_uri = None
         track = {
@@ -146,69 +152,78 @@ async def main():
         }
         # position, duration = ui.play_progress.play_position, ui.play_progress.track_duration
         while True:
-            last_change = await ev.wait()
-            ev.clear()
+            changed = await changes.get()
 
             # update player state
-            cur_state = last_change['TransportState_attrs', 0]['val']
+            if 'TransportState' in changed:
+                cur_state = changed['TransportState']
             # TODO: update current play position
             # update current track duration
-            ui.play_progress.track_duration = last_change['CurrentTrackDuration_attrs', 0]['val']
-            trackmeta = (babyxml.xmltodict(htmldecode(last_change['CurrentTrackMetaData_attrs', 0]['val']))
-                            .get(('DIDL-Lite', 0), {})
-                            .get(('item', 0), {}))
-            # update current track info
-            cur_track = {
-                'title': htmldecode(trackmeta.get(('dc:title', 0), '')),
-                'artist': htmldecode(trackmeta.get(('dc:creator', 0), '')),
-                'album': htmldecode(trackmeta.get(('upnp:album', 0), '')),
-            }
-            if track != cur_track:
-                ui.track_info.artist_name = cur_track['artist']
-                ui.track_info.album_name = cur_track['album']
-                ui.track_info.track_name = cur_track['title']
-                track = cur_track
-                print(f'[{datetime.now()}] track is now {cur_track["artist"]} - {cur_track["album"]} - {cur_track["title"]}')
-
-            # update album art uri
-            album_art_uri = (
-                htmldecode(trackmeta.get(('upnp:albumArtURI', 0), ''))
-                    # modify some arguments
-                    .replace('?w=200&auto=format,compress?w=200', '?w=400&fm=jpg&jpeg-progressive=false')
-                    .replace('&auto=format,compress', ''))
-            if album_art_uri and '://' not in album_art_uri:
-                album_art_uri = f'{player_manager.player.base}{album_art_uri}'
-            if album_art_uri != last_album_art_uri:
-                album_art_changed.set(album_art_uri)
-                last_album_art_uri = album_art_uri
+            if 'CurrentTrackDuration' in changed:
+                ui.play_progress.track_duration = changed['CurrentTrackDuration']
+
+            if 'CurrentTrackMetaData' in changed:
+                trackmeta = didl_item(changed['CurrentTrackMetaData'])
+                # update current track info
+                cur_track = {
+                    'title': trackmeta['title'],
+                    'artist': trackmeta['artist'],
+                    'album': trackmeta['album'],
+                }
+                if track != cur_track:
+                    ui.track_info.artist_name = cur_track['artist']
+                    ui.track_info.album_name = cur_track['album']
+                    ui.track_info.track_name = cur_track['title']
+                    track = cur_track
+                    print(f'[{datetime.now()}] track is now {cur_track["artist"]} - {cur_track["album"]} - {cur_track["title"]}')
+
+                # update album art uri
+                album_art_uri = (
+                    trackmeta['album_art']
+                        # modify some arguments
+                        .replace('?w=200&auto=format,compress?w=200', '?w=400&fm=jpg&jpeg-progressive=false')
+                        .replace('&auto=format,compress', ''))
+                if album_art_uri and '://' not in album_art_uri:
+                    album_art_uri = f'{player_manager.player.base}{album_art_uri}'
+                if album_art_uri != last_album_art_uri:
+                    album_art_changed.publish(album_art_uri)
+                    last_album_art_uri = album_art_uri
 
             # update current medium info
-            urimeta = babyxml.xmltodict(htmldecode(last_change['AVTransportURIMetaData_attrs', 0]['val']))['DIDL-Lite', 0]['item', 0]
-            ui.track_info.media_title = htmldecode(urimeta.get(('dc:title', 0), ''))
+            if 'AVTransportURIMetaData' in changed:
+                ui.track_info.media_title = didl_item(changed['AVTransportURIMetaData'])['title']
 
     @task_restart('album_art')
     async def _album_art():
+        album_art_uris = album_art_changed.subscribe(event.LATEST, replay=True)
         while True:
-            album_art_uri = await album_art_changed.wait()
-            album_art_changed.clear()
+            album_art_uri = await album_art_uris.get()
 
             if album_art_uri:
                 print(f'loading album_art from {album_art_uri}')
-                resp = None
-                while not resp:
+                buf = None
+                while buf is None:
                     try:
-                        resp = await ahttp.get(album_art_uri, {})
+                        resp = await ahttp.get(album_art_uri, {}, stream=True, cache=ahttp.cache)
+                        print('buffering album_art...')
+                        if not resp.streaming:
+                            # answered from the cache
+                            buf = resp.content
+                        elif 'content-length' in resp.headers:
+                            # stream the jpeg straight into a buffer of the right size
+                            buf = bytearray(int(resp.headers['content-length']))
+                            await asyncio.wait_for(resp.readinto(buf), ahttp.DEFAULT_TIMEOUT)
+                        else:
+                            buf = await asyncio.wait_for(resp.read(), ahttp.DEFAULT_TIMEOUT)
                     except asyncio.TimeoutError:
                         print(f'[{datetime.now()}] TIMEOUT - retry')
+                        buf = None
                         await asyncio.sleep_ms(200)
                     except OSError as e:
                         print(f'[{datetime.now()}] {type(e)}({e}) - retry')
+                        buf = None
                         await asyncio.sleep_ms(200)
-                    else:
-                        break
 
-                print('buffering album_art...')
-                buf = io.BytesIO(resp.body)
                 print('show album_art')
                 ui.album_art.show(buf)
             else:
@@ -217,10 +232,9 @@ async def main():
 
     @task_restart('prev')
     async def _prev():
-        press = ano.events['left_press']
+        presses = ano.events['left_press'].subscribe(event.LATEST)
         while True:
-            await press.wait()
-            press.clear()
+            await presses.get()
             if player_manager.is_connected:
                 # show back indicator
                 ui.track_info.show_icon('prev')
@@ -231,10 +245,9 @@ async def main():
 
     @task_restart('next')
     async def _next():
-        press = ano.events['right_press']
+        presses = ano.events['right_press'].subscribe(event.LATEST)
         while True:
-            await press.wait()
-            press.clear()
+            await presses.get()
             if player_manager.is_connected:
                 # show next indicator
                 ui.track_info.show_icon('next')
@@ -245,10 +258,9 @@ async def main():
     @task_restart('play_pause')
     async def _play_pause():
         nonlocal cur_state
-        on_select_press = ano.events['select_press']
+        select_presses = ano.events['select_press'].subscribe(event.LATEST)
         while True:
-            await on_select_press.wait()
-            on_select_press.clear()
+            await select_presses.get()
 
             if player_manager.is_connected:
                 # I wish it didn't have to be this way
@@ -264,24 +276,39 @@ async def main():
                     await player_manager.player.pause()
                     ui.track_info.hide_icon('pause')
 
+    @task_restart('rendering_control_event_handler')
+    async def _rendering_control():
+        nonlocal cur_volume
+        await player_manager.connected.wait()
+        # volume changes from anywhere (including the phone app) are evented
+        changes = player_manager.callback_events['RenderingControl'].watch('Volume', 'Mute')
+        while True:
+            changed = await changes.get()
+            if 'Volume' in changed:
+                cur_volume = ui.volume.volume = int(changed['Volume'])
+            if 'Mute' in changed:
+                ui.volume.muted = changed['Mute'] == '1'
+
     @task_restart('volume')
     async def _volume():
-        ev = ano.events['encoder']
+        nonlocal cur_volume
+        # encoder positions; turns made while the speaker is being set are folded into one
+        positions = ano.events['encoder'].subscribe(event.LATEST)
         await player_manager.connected.wait()
         # get initial encoder position for delta tracking
         pos = ano.encoder.position
-        vol = ui.volume.volume = await player_manager.player.volume()
 
         while True:
-            await ev.wait()
             # get new encoder position and calculate delta from last time
-            new_pos = ano.encoder.position
+            new_pos = await positions.get()
             delta, pos = new_pos - pos, new_pos
 
             # if position changed, update the UI and speaker
             if player_manager.is_connected and delta:
-                vol = ui.volume.volume = await player_manager.player.volume(vol + delta)
-            ev.clear()
+                if cur_volume is None:
+                    # no RenderingControl event yet
+                    cur_volume = await player_manager.player.volume()
+                cur_volume = ui.volume.volume = await player_manager.player.volume(cur_volume + delta)
 
     @task_restart('tickle_watchdog')
     async def _tickle_watchdog():
@@ -297,6 +324,7 @@ async def main():
     loop.create_task(_status_ip())
     loop.create_task(_avtransport())
     loop.create_task(_album_art())
+    loop.create_task(_rendering_control())
     # controls tasks with ui implications
     loop.create_task(_prev())
     loop.create_task(_next())
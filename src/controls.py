@@ -1,10 +1,13 @@
 import asyncio
 import board
+import time
 import digitalio
 
 import adafruit_pca9554
 from adafruit_seesaw import seesaw, rotaryio
 
+import event
+
 
 ANO_BUTTON_MAP = {
     'select': 1,
@@ -13,6 +16,8 @@ ANO_BUTTON_MAP = {
     'down': 4,
     'right': 5,
 }
+# presses/positions kept for subscribers that haven't caught up yet
+EVENT_HISTORY = 4
 
 async def _scan(bus, addr):
     # scan i2c bus for our device
@@ -48,12 +53,13 @@ class AnoRotary:
         self.seesaw = seesaw
         self.encoder = encoder
         # prepare events
+        # buttons publish the time.monotonic() of each press/release, the encoder its new position
         self.events = {
-            f'{name}_{direction}': asyncio.Event()
+            f'{name}_{direction}': event.Channel(EVENT_HISTORY)
             for name in ANO_BUTTON_MAP
             for direction in ('press', 'release')
         }
-        self.events['encoder'] = asyncio.Event()
+        self.events['encoder'] = event.Channel(EVENT_HISTORY)
 
     async def _start_monitor(self):
         loop = asyncio.get_event_loop()
@@ -82,7 +88,7 @@ class AnoRotary:
                     new_state = full_state & mask
                     if new_state != last_states[name]:
                         direction = 'release' if new_state else 'press'
-                        self.events[f'{name}_{direction}'].set()
+                        self.events[f'{name}_{direction}'].publish(time.monotonic())
                         last_states[name] = new_state
                 last_full_state = full_state
 
@@ -95,11 +101,8 @@ class AnoRotary:
             cur_pos = encoder.position
             if cur_pos != pos:
                 pos = cur_pos
-                self.events['encoder'].set()
-                while self.events['encoder'].is_set():
-                    await asyncio.sleep_ms(10)
-            else:
-                await asyncio.sleep_ms(10)
+                self.events['encoder'].publish(pos)
+            await asyncio.sleep_ms(10)
 
 
 class QualiaButtons:
@@ -122,10 +125,10 @@ class QualiaButtons:
         self._btn_dn = btn_dn
         self._btn_up = btn_up
         self.events = {
-            'up_press': asyncio.Event(),
-            'up_release': asyncio.Event(),
-            'dn_press': asyncio.Event(),
-            'dn_release': asyncio.Event(),
+            'up_press': event.Channel(EVENT_HISTORY),
+            'up_release': event.Channel(EVENT_HISTORY),
+            'dn_press': event.Channel(EVENT_HISTORY),
+            'dn_release': event.Channel(EVENT_HISTORY),
         }
 
     async def _start_monitors(self):
@@ -139,9 +142,9 @@ class QualiaButtons:
             cur_state = btn.value
             if cur_state != last_state:
                 if cur_state is False:
-                    press.set()
+                    press.publish(time.monotonic())
                 else:
-                    release.set()
+                    release.publish(time.monotonic())
                 last_state = cur_state
 
             await asyncio.sleep_ms(50)
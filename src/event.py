@@ -1,19 +1,82 @@
 import asyncio
 
 
-class EventWithData(asyncio.Event):
-    def __init__(self):
-        super().__init__()
-        self.data = None
-
-    def set(self, data):
-        self.data = data
-        super().set()
-
-    def clear(self):
-        self.data = None
-        super().clear()
-
-    async def wait(self):
-        await super().wait()
-        return self.data
+# Subscriber coalescing modes
+# every message, oldest first (as long as the subscriber keeps within the channel history)
+QUEUE = 0
+# only the newest message; older ones that haven't been read yet are skipped
+LATEST = 1
+
+
+class Channel:
+    # broadcast channel: every subscriber sees the messages published after it subscribed
+    # the channel only keeps the last `history` messages in a ring buffer and each subscriber
+    # has its own cursor into it, so publishing never waits on (or even knows about) subscribers
+    def __init__(self, history=8):
+        self._ring = [None] * history
+        # number of messages published so far
+        self.seq = 0
+        # pulsed on every publish
+        self._published = asyncio.Event()
+
+    @property
+    def history(self):
+        return len(self._ring)
+
+    @property
+    def latest(self):
+        if self.seq:
+            return self._ring[(self.seq - 1) % len(self._ring)]
+        return None
+
+    def publish(self, message):
+        self._ring[self.seq % len(self._ring)] = message
+        self.seq += 1
+        # wakes everything waiting right now; later waits block until the next publish
+        self._published.set()
+        self._published.clear()
+
+    def subscribe(self, coalesce=QUEUE, replay=False):
+        # replay: start with the messages still in the history (just the latest one for LATEST)
+        return Subscriber(self, coalesce, replay)
+
+
+class Subscriber:
+    def __init__(self, channel, coalesce=QUEUE, replay=False):
+        self._channel = channel
+        self.coalesce = coalesce
+        self.cursor = channel.seq
+        if replay:
+            self.cursor = max(0, channel.seq - (1 if coalesce == LATEST else channel.history))
+        # messages read, and ones lost by falling more than the channel history behind
+        self.received = 0
+        self.missed = 0
+
+    def pending(self):
+        return self._channel.seq - self.cursor
+
+    def skip(self):
+        # drop whatever hasn't been read yet
+        self.cursor = self._channel.seq
+
+    def get_nowait(self):
+        channel = self._channel
+        behind = channel.seq - self.cursor
+        if not behind:
+            raise IndexError('no messages')
+        if self.coalesce == LATEST:
+            # skipping older messages is the point, so they don't count as missed
+            self.cursor = channel.seq - 1
+        elif behind > channel.history:
+            # overwritten already
+            self.missed += behind - channel.history
+            self.cursor = channel.seq - channel.history
+        message = channel._ring[self.cursor % channel.history]
+        self.cursor += 1
+        self.received += 1
+        return message
+
+    async def get(self):
+        while self.cursor == self._channel.seq:
+            await self._channel._published.wait()
+        return self.get_nowait()
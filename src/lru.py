@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+
+class LRU:
+    # bounded least-recently-used mapping
+    # bounded by number of entries and, optionally, by the total size of the entries
+    def __init__(self, max_entries, max_size=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._on_evict = on_evict
+        # key: (value, size)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        # move to the most recently used end
+        entry = self._entries.pop(key)
+        self._entries[key] = entry
+        return entry[0]
+
+    def put(self, key, value, size=0):
+        self.pop(key)
+        if self.max_size is not None and size > self.max_size:
+            # would never fit
+            return False
+        self._entries[key] = (value, size)
+        self.size += size
+        while len(self._entries) > self.max_entries or (self.max_size is not None and self.size > self.max_size):
+            oldest = next(iter(self._entries))
+            old_value, _ = self._entries[oldest]
+            self.pop(oldest)
+            if self._on_evict is not None:
+                self._on_evict(oldest, old_value)
+        return True
+
+    def pop(self, key, default=None):
+        if key not in self._entries:
+            return default
+        value, size = self._entries.pop(key)
+        self.size -= size
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -11,6 +11,10 @@ import ssdp
 import timezone
 
 
+# everything the display follows is evented, nothing is polled
+SUBSCRIBED_SERVICES = ('AVTransport', 'RenderingControl', 'ZoneGroupTopology')
+
+
 class PlayerManager:
     @property
     def is_connected(self):
@@ -21,17 +25,22 @@ class PlayerManager:
         self.player_name = None
         self.connected = asyncio.Event()
         self.callback_events = {}
-        self._maintain_subscription_task = None
+        self._zone_group_task = None
 
-    async def maintain_upnp_subscription(self):
-        await self.connected.wait()
+    async def follow_zone_group(self):
+        # keep the player's zone attributes current
+        changes = self.callback_events['ZoneGroupTopology'].watch(*asonos.ZONE_GROUP_ATTRS)
         while True:
-            # wait 5 minutes and then refresh
-            await asyncio.sleep(60)
-            # refresh all subscriptions
-            await asyncio.gather(*(
-                self.player.refresh_subscription(svc) for svc in self.callback_events
-            ))
+            try:
+                changed = await changes.get()
+                self.player.update_zone_attrs(changed)
+                if 'ZoneGroupName' in changed:
+                    print(f'[{datetime.now()}] zone group is now {changed["ZoneGroupName"]}')
+            except Exception as e:
+                # one bad event mustn't end zone group tracking for the rest of the session
+                print(f'[{datetime.now()}] following zone group failed: {type(e).__name__}({e})')
+                traceback.print_exception(e)
+                await asyncio.sleep_ms(10)
 
     @staticmethod
     def init_storage():
@@ -58,8 +67,6 @@ class PlayerManager:
             }, f)
 
     async def load_player(self):
-        if self._maintain_subscription_task is None:
-            self._maintain_subscription_task = asyncio.get_event_loop().create_task(self.maintain_upnp_subscription())
         # load from cache
         cached = player_cache()
         if cached:
@@ -87,7 +94,11 @@ class PlayerManager:
             except Exception as e:
                 print(f'[{datetime.now()}] cache_player failed Exception: {type(e)}({e})')
 
-        self.callback_events['AVTransport'] = await self.player.subscribe('AVTransport')
+        # subscriptions are renewed (or replaced) by asonos.renew_subscriptions; the events carry on either way
+        events = await asyncio.gather(*(self.player.subscribe(service) for service in SUBSCRIBED_SERVICES))
+        self.callback_events.update(zip(SUBSCRIBED_SERVICES, events))
+        if self._zone_group_task is None:
+            self._zone_group_task = asyncio.get_event_loop().create_task(self.follow_zone_group())
         self.connected.set()
         return self.player
 
@@ -0,0 +1,100 @@
+import asyncio
+import select
+import sys
+
+
+# readiness waits park the task on asyncio's own I/O queue (asyncio.core._io_queue, the one asyncio's
+# streams use); the event loop polls it whenever it's otherwise idle so parked tasks cost nothing until
+# their socket is ready. it's private, so this leans on how MicroPython-style asyncio works:
+#   - coroutines are generators, and `yield _io_queue.queue_read(sock)` (queue_write for writes)
+#     parks the running task until sock is ready
+#   - cancelling a parked task (e.g. wait_for timing out) calls _io_queue.remove(task), which takes
+#     it back out of the poller
+# anywhere that doesn't hold (CPython, or a port whose I/O queue looks different) sockets are
+# waited on with Backoff instead
+_IO_QUEUE_METHODS = ('queue_read', 'queue_write', 'remove')
+_generator_coroutines = sys.implementation.name in {'micropython', 'circuitpython'}
+# socket type: whether or not select.poll accepts it
+_pollable = {}
+
+
+class Backoff:
+    # adaptive sleep for sockets that can't be polled
+    # starts short so a quick answer isn't delayed, then backs off while nothing is happening
+    def __init__(self, initial_ms=1, max_ms=100):
+        self.initial_ms = initial_ms
+        self.max_ms = max_ms
+        self.delay_ms = initial_ms
+
+    def reset(self):
+        self.delay_ms = self.initial_ms
+
+    async def wait(self):
+        await asyncio.sleep_ms(self.delay_ms)
+        self.delay_ms = min(2 * self.delay_ms, self.max_ms)
+
+
+def _io_queue():
+    # looked up on every wait since asyncio.new_event_loop() replaces it
+    if not _generator_coroutines:
+        return None
+    io_queue = getattr(getattr(asyncio, 'core', None), '_io_queue', None)
+    if io_queue is None or not all(callable(getattr(io_queue, method, None)) for method in _IO_QUEUE_METHODS):
+        return None
+    return io_queue
+
+
+def can_poll(sock):
+    if _io_queue() is None:
+        return False
+    sock_type = type(sock)
+    if sock_type not in _pollable:
+        try:
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            poller.unregister(sock)
+        except (AttributeError, OSError, TypeError, ValueError):
+            _pollable[sock_type] = False
+        else:
+            _pollable[sock_type] = True
+    return _pollable[sock_type]
+
+
+async def _wait_read(sock):
+    yield _io_queue().queue_read(sock)
+
+
+async def _wait_write(sock):
+    yield _io_queue().queue_write(sock)
+
+
+async def _wait(io_wait, sock, backoff, timeout):
+    # returns True once sock is ready, False if timeout (seconds) passed first
+    # or None if sock can't be polled and we just backed off for a bit instead
+    if not can_poll(sock):
+        if backoff is None:
+            await asyncio.sleep(0)
+        else:
+            await backoff.wait()
+        return None
+
+    if backoff is not None:
+        backoff.reset()
+    if timeout is None:
+        await io_wait(sock)
+        return True
+    try:
+        await asyncio.wait_for(io_wait(sock), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+async def wait_readable(sock, backoff=None, timeout=None):
+    # call this after a read on a non-blocking socket came back with EAGAIN
+    return await _wait(_wait_read, sock, backoff, timeout)
+
+
+async def wait_writable(sock, backoff=None, timeout=None):
+    # call this after a send/connect on a non-blocking socket came back with EAGAIN/EINPROGRESS
+    return await _wait(_wait_write, sock, backoff, timeout)
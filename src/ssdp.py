@@ -1,10 +1,12 @@
 import asyncio
 import collections
-import ipaddress
 import time
 import wifi
 from socketpool import SocketPool
 
+import adns
+import reactor
+
 
 pool = SocketPool(wifi.radio)
 MCAST_GRP = '239.255.255.250'
@@ -34,7 +36,7 @@ async def _sock():
     return s
 
 
-def parse_ssdp_response(resp):
+async def parse_ssdp_response(resp):
     headers = dict(l.split(': ') for l in resp.splitlines() if ': ' in l)
     proto, url = headers['LOCATION'].split('://')
     hostport = url.split('/')[0]
@@ -44,15 +46,8 @@ def parse_ssdp_response(resp):
         host = hostport
         port = PROTO_PORTS[proto]
 
-    try:
-        ipaddress.ip_address(host)
-    except ValueError:
-        # this is a hostname, not an ip
-        # TODO: need to write my own little async dns client
-        raise
-
     return {
-        'ip': host,
+        'ip': await adns.resolve(host),
         'port': port,
         'base': headers['LOCATION'][:headers['LOCATION'].index('/', 8)],
         'household_id': headers.pop('X-RINCON-HOUSEHOLD', None),
@@ -76,19 +71,25 @@ class ResponseReader:
 
     async def __anext__(self):
         read_nbytes = 0
+        backoff = reactor.Backoff()
 
         while True:
             try:
                 read_nbytes, (host, port) = self.sock.recvfrom_into(self._buf)
             except OSError:
-                await asyncio.sleep_ms(100)
+                # wake up when the next response arrives, or in time to notice responses have dried up
+                timeout = None
+                if self.last_read > 0:
+                    timeout = max(0, self.last_read + 10 - time.time())
+                await reactor.wait_readable(self.sock, backoff, timeout=timeout)
             else:
+                backoff.reset()
                 self.last_read = time.time()
                 if host not in self._ignore_hosts:
                     resp_raw = self._buf[:read_nbytes].decode()
                     self.reset_buffer()
 
-                    parsed = parse_ssdp_response(resp_raw)
+                    parsed = await parse_ssdp_response(resp_raw)
                     if parsed['household_id']:
                         return parsed
                     else:
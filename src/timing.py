@@ -0,0 +1,120 @@
+import time
+
+
+# histogram bucket upper bounds, in ms (the last bucket catches everything slower)
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+PHASES = ('dns', 'acquire', 'connect', 'ttfb', 'body', 'total')
+
+
+def ms_since(start_ns, end_ns):
+    # marks stay integer ns; only the (small) difference becomes a float, which would otherwise
+    # lose all its sub-second precision after a few hours of uptime on a 30-bit float
+    return (end_ns - start_ns) / 1_000_000
+
+
+class RequestTiming:
+    # timings (in ms) for each phase of a single request
+    #   dns     - hostname lookup
+    #   acquire - waiting for a connection slot/pooled socket
+    #   connect - socket creation, connect attempts and sending the request
+    #   ttfb    - request sent until the response headers arrived
+    #   body    - reading the response body
+    #   total   - all of the above
+    def __init__(self, verb, host, action):
+        self.verb = verb
+        self.host = host
+        self.action = action
+        self.status_code = None
+        self.reused = False
+        self.connect_attempts = 0
+        self.error = None
+        self.dns = None
+        self.acquire = None
+        self.connect = None
+        self.ttfb = None
+        self.body = None
+        self.total = None
+        self._start = self._mark = time.monotonic_ns()
+
+    def __repr__(self):
+        phases = ' '.join(f'{phase}={getattr(self, phase):.1f}' for phase in PHASES if getattr(self, phase) is not None)
+        return f'<RequestTiming {self.verb} {self.host} {self.action} {phases}>'
+
+    def lap(self, phase):
+        # record the time since the last lap as phase
+        t = time.monotonic_ns()
+        setattr(self, phase, ms_since(self._mark, t))
+        self._mark = t
+
+    def finish(self):
+        self.total = ms_since(self._start, time.monotonic_ns())
+
+
+class Histogram:
+    # rolling histogram over the last `window` samples
+    def __init__(self, window=32):
+        self.window = window
+        self.count = 0
+        self._samples = []
+
+    def add(self, value):
+        if len(self._samples) < self.window:
+            self._samples.append(value)
+        else:
+            self._samples[self.count % self.window] = value
+        self.count += 1
+
+    def buckets(self):
+        counts = [0] * (len(BUCKETS_MS) + 1)
+        for value in self._samples:
+            for i, bound in enumerate(BUCKETS_MS):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return counts
+
+    def percentile(self, p):
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def summary(self):
+        return {
+            'n': len(self._samples),
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'max': max(self._samples) if self._samples else None,
+        }
+
+
+class TimingStats:
+    # rolling histograms of each phase for one host or one action
+    def __init__(self, window=32):
+        self.requests = 0
+        self.errors = 0
+        self.reused = 0
+        self.phases = {phase: Histogram(window) for phase in PHASES}
+        self.connect_attempts = Histogram(window)
+
+    def add(self, timing):
+        self.requests += 1
+        if timing.error is not None:
+            self.errors += 1
+        if timing.reused:
+            self.reused += 1
+        for phase, histogram in self.phases.items():
+            value = getattr(timing, phase)
+            if value is not None:
+                histogram.add(value)
+        if timing.connect_attempts:
+            self.connect_attempts.add(timing.connect_attempts)
+
+    def summary(self):
+        summary = {phase: histogram.summary() for phase, histogram in self.phases.items()}
+        summary['requests'] = self.requests
+        summary['errors'] = self.errors
+        summary['reused'] = self.reused
+        return summary
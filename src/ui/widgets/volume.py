@@ -6,15 +6,30 @@ from .slider import Slider
 class Volume(Slider):
     @property
     def volume(self):
-        return int(self.position * 100)
+        # kept as given; position is a float and wouldn't always round-trip back to it
+        return self._volume
 
     @volume.setter
     def volume(self, new_vol):
-        self._vol_label.text = f'{new_vol}'
+        self._volume = new_vol
+        if not self._muted:
+            self._vol_label.text = f'{new_vol}'
         self.position = new_vol / 100
 
+    @property
+    def muted(self):
+        return self._muted
+
+    @muted.setter
+    def muted(self, muted):
+        self._muted = muted
+        # the slider keeps showing the volume it'll go back to
+        self._vol_label.text = 'M' if muted else f'{self._volume}'
+
     def __init__(self, *args, **kwargs):
         super().__init__(orientation='vertical', **kwargs)
+        self._muted = False
+        self._volume = round(self.position * 100)
 
         self._vol_label = label.Label(terminalio.FONT, text='50', scale=2)
         self._vol_label.anchor_point = (0.5, 0.5)